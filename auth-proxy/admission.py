@@ -0,0 +1,322 @@
+"""
+Admission control for upstream CouchDB calls
+Adaptive (AIMD) concurrency limit shared by per-class priority queues
+with weighted fair scheduling, so bulk syncs can't starve live edits
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional, Dict
+
+from metrics import metrics
+
+
+INTERACTIVE = "interactive"
+LIVE = "live"
+BULK = "bulk"
+ATTACHMENT = "attachment"
+
+# Database endpoints that move many documents per call
+BULK_READ_ENDPOINTS = {"_bulk_get", "_all_docs", "_find", "_design_docs"}
+
+
+def classify_request(method: str, path: str, content_length: int = 0, bulk_write_threshold: int = 256 * 1024) -> str:
+    """
+    Traffic class of a CouchDB request, from path and method alone
+
+    interactive - single documents, _local checkpoints, _revs_diff and small
+                  _bulk_docs (LiveSync pushes each edit through _bulk_docs)
+    live        - _changes polls
+    bulk        - multi-document reads and large _bulk_docs uploads
+    attachment  - /{db}/{docid}/{attachment}
+    """
+    parts = path.strip("/").split("/")
+    if len(parts) < 2:
+        return INTERACTIVE
+
+    endpoint = parts[1]
+    if endpoint == "_changes":
+        return LIVE
+    if endpoint in BULK_READ_ENDPOINTS:
+        return BULK
+    if endpoint == "_bulk_docs":
+        return BULK if content_length > bulk_write_threshold else INTERACTIVE
+    if len(parts) >= 3 and not endpoint.startswith("_"):
+        return ATTACHMENT
+    return INTERACTIVE
+
+
+# Endpoints whose bodies are ids, revisions or query parameters - never documents
+QUERY_BODY_ENDPOINTS = {
+    "_revs_diff", "_bulk_get", "_all_docs", "_changes", "_find", "_explain",
+    "_missing_revs", "_purge", "_index", "_design_docs",
+}
+
+
+class BodyLimits:
+    """
+    Largest request body accepted per kind of endpoint
+
+    Checked against Content-Length before the body is read (so clients
+    sending Expect: 100-continue never upload a rejected body) and again
+    while a chunked body streams in.
+
+    document - single documents and _local checkpoints (CouchDB's max_document_size)
+    request  - _bulk_docs and attachments (CouchDB's max_http_request_size)
+    query    - id lists and query parameters (_revs_diff, _bulk_get, _changes, ...)
+    """
+
+    def __init__(self, document: int, request: int, query: int):
+        self.document = document
+        self.request = request
+        self.query = query
+        self.rejected = metrics.counter(
+            "request_body_rejected_total", "Requests refused on their declared Content-Length")
+        self.aborted = metrics.counter(
+            "request_body_aborted_total", "Streamed request bodies cut off at the size limit")
+
+    def limit(self, method: str, path: str) -> int:
+        parts = path.strip("/").split("/")
+        if len(parts) < 2:
+            # POST /{db} creates a document; server endpoints take small JSON
+            return self.document if parts[0] and not parts[0].startswith("_") else self.query
+        endpoint = parts[1]
+        if endpoint in QUERY_BODY_ENDPOINTS:
+            return self.query
+        if endpoint == "_bulk_docs" or (len(parts) >= 3 and not endpoint.startswith("_")):
+            return self.request
+        return self.document
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get an upstream slot in time"""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TrafficClass:
+    """Scheduling state of one traffic class"""
+
+    def __init__(
+        self,
+        name: str,
+        weight: float,
+        max_share: float = 1.0,
+        max_queue: int = 500,
+        queue_timeout: float = 10.0
+    ):
+        self.name = name
+        self.weight = weight
+        self.max_share = max_share
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.inflight = 0
+        self.pass_value = 0.0
+        self.waiters: deque = deque()
+
+        self.shed = metrics.counter(f"upstream_admission_rejected_{name}_total", f"{name} requests shed")
+        metrics.gauge(f"upstream_inflight_{name}", f"{name} upstream requests in flight", lambda: self.inflight)
+        metrics.gauge(f"upstream_queue_depth_{name}", f"{name} requests waiting for a slot", lambda: len(self.waiters))
+
+    def snapshot(self) -> dict:
+        return {
+            "weight": self.weight,
+            "max_share": self.max_share,
+            "inflight": self.inflight,
+            "queue_depth": len(self.waiters),
+            "rejected": self.shed.value,
+        }
+
+
+# name: (weight, max share of the limit, max queue length, queue timeout seconds)
+DEFAULT_CLASSES = {
+    INTERACTIVE: (8, 1.0, 500, 10.0),
+    LIVE: (4, 0.5, 200, 10.0),
+    BULK: (2, 0.5, 100, 30.0),
+    ATTACHMENT: (1, 0.3, 50, 30.0),
+}
+
+
+def parse_class_config(spec: str) -> Dict[str, tuple]:
+    """
+    Parse ADMISSION_CLASSES overrides on top of DEFAULT_CLASSES
+
+    Format: "name=weight:max_share:max_queue:queue_timeout,..." where trailing
+    fields may be omitted, e.g. "bulk=1:0.3,attachment=1:0.2:20"
+    """
+    classes = dict(DEFAULT_CLASSES)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, values = item.partition("=")
+        name = name.strip()
+        base = list(classes.get(name, DEFAULT_CLASSES[INTERACTIVE]))
+        for i, value in enumerate(values.split(":")[:4]):
+            if value:
+                base[i] = int(value) if i == 2 else float(value)
+        classes[name] = tuple(base)
+    return classes
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to CouchDB latency, shared fairly between classes
+
+    The limit grows by roughly one slot per round trip while responses stay
+    within latency_tolerance x the baseline latency, and is multiplied by
+    decrease_factor on a latency spike, a 5xx or a timeout (at most once per
+    baseline window, so one slow burst does not collapse it to the floor).
+    The baseline tracks the lowest recent latency and drifts up slowly so a
+    permanent shift is eventually accepted.
+
+    Requests over the limit wait in per-class FIFO queues. Freed slots go to
+    the waiting class with the lowest virtual pass (stride scheduling), so
+    each class gets slots in proportion to its weight while it has work.
+    A class never holds more than max_share of the limit, leaving headroom
+    for the others, and sheds with AdmissionRejected when its queue is full
+    or a request waits longer than its queue_timeout.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 20,
+        min_limit: int = 2,
+        max_limit: int = 200,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 2.0,
+        classes: Optional[Dict[str, tuple]] = None
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.inflight = 0
+        self.baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self.classes = {
+            name: TrafficClass(name, *config)
+            for name, config in (classes or DEFAULT_CLASSES).items()
+        }
+
+        self._rejected = metrics.counter("upstream_admission_rejected_total", "Requests shed by the concurrency limiter")
+        metrics.gauge("upstream_concurrency_limit", "Current adaptive upstream concurrency limit", lambda: int(self.limit))
+        metrics.gauge("upstream_inflight", "Upstream requests in flight", lambda: self.inflight)
+        metrics.gauge("upstream_queue_depth", "Requests waiting for an upstream slot", lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(cls.waiters) for cls in self.classes.values())
+
+    def _class_cap(self, cls: TrafficClass) -> int:
+        return max(1, int(self.limit * cls.max_share))
+
+    def _can_admit(self, cls: TrafficClass) -> bool:
+        return self.inflight < int(self.limit) and cls.inflight < self._class_cap(cls)
+
+    def _admit(self, cls: TrafficClass):
+        self.inflight += 1
+        cls.inflight += 1
+        cls.pass_value += 1.0 / cls.weight
+
+    async def acquire(self, class_name: str = INTERACTIVE):
+        """Wait for an upstream slot for a request of class_name or raise AdmissionRejected"""
+        cls = self.classes.get(class_name) or self.classes[INTERACTIVE]
+
+        if not cls.waiters and self._can_admit(cls):
+            self._catch_up(cls)
+            self._admit(cls)
+            return
+
+        if len(cls.waiters) >= cls.max_queue:
+            cls.shed.inc()
+            self._rejected.inc()
+            raise AdmissionRejected(f"Upstream queue full ({cls.name})")
+
+        if not cls.waiters:
+            self._catch_up(cls)
+        waiter = asyncio.get_running_loop().create_future()
+        cls.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, cls.queue_timeout)
+        except asyncio.TimeoutError:
+            cls.shed.inc()
+            self._rejected.inc()
+            raise AdmissionRejected(f"Timed out waiting for an upstream slot ({cls.name})")
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we were cancelled - pass it on
+                self._release_slot(cls)
+            raise
+        finally:
+            if waiter in cls.waiters:
+                cls.waiters.remove(waiter)
+
+    def _catch_up(self, cls: TrafficClass):
+        """A class becoming active must not spend credit saved up while idle"""
+        active = [c.pass_value for c in self.classes.values() if c.waiters or c.inflight]
+        if active:
+            cls.pass_value = max(cls.pass_value, min(active))
+
+    def release(self, class_name: str = INTERACTIVE, latency: Optional[float] = None, overloaded: bool = False):
+        """
+        Return a slot and feed the outcome into the limit
+
+        latency=None releases without a sample (e.g. long-polling feeds).
+        """
+        if overloaded:
+            self._decrease()
+        elif latency is not None:
+            self._observe(latency)
+        self._release_slot(self.classes.get(class_name) or self.classes[INTERACTIVE])
+
+    def _observe(self, latency: float):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += 0.001 * (latency - self.baseline)
+
+        if latency > self.baseline * self.latency_tolerance:
+            self._decrease()
+        elif self.inflight >= self.limit / 2:
+            # Additive increase: about +1 per limit's worth of completions
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < max(self.baseline or 0.0, 0.1):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def _release_slot(self, cls: TrafficClass):
+        self.inflight -= 1
+        cls.inflight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiting classes in weighted fair order"""
+        while self.inflight < int(self.limit):
+            eligible = [
+                c for c in self.classes.values()
+                if c.waiters and c.inflight < self._class_cap(c)
+            ]
+            if not eligible:
+                return
+            cls = min(eligible, key=lambda c: c.pass_value)
+            waiter = cls.waiters.popleft()
+            if not waiter.done():
+                self._admit(cls)
+                waiter.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "queue_depth": self.queue_depth,
+            "baseline_latency_ms": None if self.baseline is None else round(self.baseline * 1000, 1),
+            "classes": {name: cls.snapshot() for name, cls in self.classes.items()},
+        }
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tail latency of single-document reads with and without hedging
+
+Drives main.app in-process against an in-memory CouchDB that answers in
+--latency-ms but stalls for --stall-ms on a --stall-rate fraction of
+requests (like a shard stuck behind compaction). Runs the same load with
+HEDGE_READS off and on and reports latency percentiles, hedges sent and
+hedges that won.
+
+With the defaults, about 2% of requests stall and about 2% get hedged, so
+the hedged p99 lands near the few stalls that were not rescued and moves
+between runs. Compare several runs rather than one.
+
+Usage:
+    python3 benchmarks/hedged_reads.py [--requests 5000] [--concurrency 8] [--stall-rate 0.02] [--stall-ms 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENV_FILE", "/nonexistent")
+os.environ.setdefault("JWT_HMAC_SECRET", "benchmark-secret-benchmark-secret")
+os.environ.setdefault("COUCHDB_PASSWORD", "benchmark")
+os.environ.setdefault("TOKEN_DB_PATH", os.path.join(tempfile.mkdtemp(), "tokens.db"))
+os.environ.setdefault("LOOP_MONITOR", "false")
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+import main  # noqa: E402
+from proxy_overhead import PayloadStream, call  # noqa: E402
+
+
+def stalling_couchdb(latency: float, stall: float, stall_rate: float) -> httpx.MockTransport:
+    payload = b'{"_id":"doc","_rev":"1-abc","data":"' + b"x" * 200 + b'"}'
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(stall if random.random() < stall_rate else latency)
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json", "content-length": str(len(payload))},
+            stream=PayloadStream(payload)
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_load(headers: list, requests: int, concurrency: int) -> list:
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def client():
+        for i in remaining:
+            started = time.perf_counter()
+            code = await call(main.app, "GET", f"/obsidian-sync/note-{i % 500}", headers)
+            latencies.append(time.perf_counter() - started)
+            assert code == 200, code
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return sorted(latencies)
+
+
+async def run(args):
+    await main.db.init_db()
+    token = await main.db.create_token("benchmark")
+    for node in main.upstreams.nodes:
+        node.client = httpx.AsyncClient(
+            transport=stalling_couchdb(args.latency_ms / 1000, args.stall_ms / 1000, args.stall_rate),
+            auth=node.auth
+        )
+        node.healthy = True
+
+    jwt_token = jwt.encode({"token_id": token["token_id"], "device_name": "benchmark"},
+                           main.JWT_SECRET, algorithm="HS256")
+    headers = [(b"host", b"localhost"), (b"authorization", f"Bearer {jwt_token}".encode())]
+
+    print(f"{args.requests:,} GETs x {args.concurrency}, {args.latency_ms:.0f} ms normally, "
+          f"{args.stall_rate:.1%} stalled {args.stall_ms:.0f} ms")
+    for hedged in (False, True):
+        main.HEDGE_READS = hedged
+        sent, wins = main.hedging.hedged.value, main.hedging.wins.value
+        if hedged:
+            # Learn the latency percentile before measuring
+            await run_load(headers, 500, args.concurrency)
+            sent, wins = main.hedging.hedged.value, main.hedging.wins.value
+        latencies = await run_load(headers, args.requests, args.concurrency)
+        label = "hedged" if hedged else "unhedged"
+        print(f"{label:<10} p50 {percentile(latencies, 0.5) * 1000:7.2f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  "
+              f"p99.9 {percentile(latencies, 0.999) * 1000:7.2f} ms  max {latencies[-1] * 1000:7.2f} ms", end="")
+        if hedged:
+            delay = main.hedging.windows["doc"].delay
+            print(f"  | delay {delay * 1000:.1f} ms, {main.hedging.hedged.value - sent} hedges "
+                  f"({(main.hedging.hedged.value - sent) / args.requests:.1%}), "
+                  f"{main.hedging.wins.value - wins} won")
+        else:
+            print()
+
+
+def main_args():
+    parser = argparse.ArgumentParser(description="Hedged read tail latency")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="normal CouchDB response time")
+    parser.add_argument("--stall-ms", type=float, default=200.0, help="response time of a stalled request")
+    parser.add_argument("--stall-rate", type=float, default=0.02, help="fraction of requests that stall")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(main_args()))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Event loop responsiveness under mixed admin and sync load
+
+Drives main.app in-process (CouchDB replaced by an in-memory transport)
+with steady sync traffic while admin clients repeatedly list a large token
+table and generate setup URIs. Reports sync request latency and event
+loop lag; with executors working, both should stay close to an idle run.
+
+--inline runs the admin work directly on the event loop instead of the
+executors, to show what offloading buys.
+
+Usage:
+    python3 benchmarks/loop_responsiveness.py [--tokens 50000] [--duration 10] [--admin-clients 2] [--inline]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENV_FILE", "/nonexistent")
+os.environ.setdefault("JWT_HMAC_SECRET", "benchmark-secret-benchmark-secret")
+os.environ.setdefault("COUCHDB_PASSWORD", "benchmark")
+os.environ.setdefault("ADMIN_TOKEN", "benchmark-admin")
+os.environ.setdefault("TOKEN_DB_PATH", os.path.join(tempfile.mkdtemp(), "tokens.db"))
+os.environ.setdefault("LOOP_MONITOR", "false")
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+import main  # noqa: E402
+from proxy_overhead import call, mock_couchdb  # noqa: E402
+
+
+async def admin_call(method: str, path: str, query: str) -> int:
+    """Run one admin API request through main.app, discarding the body"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"authorization", f"Bearer {main.ADMIN_TOKEN}".encode())],
+        "client": ("127.0.0.1", 50001),
+        "server": ("127.0.0.1", 5985),
+    }
+    status = {}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await main.app(scope, receive, send)
+    return status.get("code", 0)
+
+
+def seed_tokens(db_path: str, count: int):
+    now = datetime.utcnow().isoformat()
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO device_tokens (token_id, device_name, created_at, metadata) VALUES (?, ?, ?, ?)",
+            ((f"bench-{i:08d}", f"device-{i}", now, '{"platform": "benchmark"}') for i in range(count))
+        )
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def measure(tokens: int, duration: float, admin_clients: int = 2, sync_clients: int = 4,
+                  sync_interval: float = 0.01, inline: bool = False) -> dict:
+    """
+    Run sync and admin clients together for `duration` seconds; returns
+    sorted sync latencies and loop lag samples (seconds) and admin op counts
+    """
+    await main.db.init_db()
+    seed_tokens(main.TOKEN_DB_PATH, tokens)
+    token = await main.db.create_token("benchmark")
+    for node in main.upstreams.nodes:
+        node.client = httpx.AsyncClient(transport=mock_couchdb(1024), auth=node.auth)
+        node.healthy = True
+
+    if inline:
+        async def run_inline(fn, *fn_args, **kwargs):
+            return fn(*fn_args, **kwargs)
+
+        main.executors.run_db = run_inline
+        main.executors.run_cpu = run_inline
+
+    jwt_token = jwt.encode({"token_id": token["token_id"], "device_name": "benchmark"},
+                           main.JWT_SECRET, algorithm="HS256")
+    headers = [(b"host", b"localhost"), (b"authorization", f"Bearer {jwt_token}".encode())]
+
+    deadline = time.monotonic() + duration
+    sync_latencies, lags = [], []
+    admin_ops = {"list": 0, "setup_uri": 0}
+
+    async def sync_client():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            code = await call(main.app, "GET", "/obsidian-sync/doc", headers)
+            sync_latencies.append(time.perf_counter() - started)
+            assert code == 200, code
+            await asyncio.sleep(sync_interval)
+
+    async def lag_probe():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    async def admin_client(n: int):
+        while time.monotonic() < deadline:
+            if n % 2 == 0:
+                assert await admin_call("GET", "/admin/tokens/list", "include_revoked=true") == 200
+                admin_ops["list"] += 1
+            else:
+                assert await admin_call("POST", "/admin/setup-uri", f"device_name=bench-{n}") == 200
+                admin_ops["setup_uri"] += 1
+
+    clients = [sync_client() for _ in range(sync_clients)]
+    clients += [admin_client(n) for n in range(admin_clients)]
+    await asyncio.gather(lag_probe(), *clients)
+    return {"sync": sorted(sync_latencies), "lag": sorted(lags), "admin_ops": admin_ops}
+
+
+async def run(args):
+    result = await measure(args.tokens, args.duration, args.admin_clients, args.sync_clients,
+                           args.sync_interval, args.inline)
+    main.executors.shutdown()
+
+    sync_latencies, lags, admin_ops = result["sync"], result["lag"], result["admin_ops"]
+    mode = "inline (event loop)" if args.inline else "executors"
+    print(f"admin work:   {mode}, {args.tokens:,} tokens, {args.admin_clients} admin client(s), {args.duration:.0f}s")
+    print(f"admin ops:    {admin_ops['list']} token lists, {admin_ops['setup_uri']} setup URIs")
+    print(f"sync:         {len(sync_latencies)} requests  p50 {percentile(sync_latencies, 0.5) * 1000:.2f} ms  "
+          f"p99 {percentile(sync_latencies, 0.99) * 1000:.2f} ms  max {sync_latencies[-1] * 1000:.2f} ms")
+    print(f"loop lag:     p50 {percentile(lags, 0.5) * 1000:.2f} ms  p99 {percentile(lags, 0.99) * 1000:.2f} ms  "
+          f"max {lags[-1] * 1000:.2f} ms")
+
+
+def main_args():
+    parser = argparse.ArgumentParser(description="Event loop responsiveness under admin load")
+    parser.add_argument("--tokens", type=int, default=50000, help="rows in the token table")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--admin-clients", type=int, default=2, help="concurrent admin clients (even: list, odd: setup URI)")
+    parser.add_argument("--sync-clients", type=int, default=4, help="concurrent sync clients")
+    parser.add_argument("--sync-interval", type=float, default=0.01, help="pause between a sync client's requests")
+    parser.add_argument("--inline", action="store_true", help="run admin work on the event loop")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(main_args()))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Per-request overhead of the CouchDB proxy path
+
+Drives main.app in-process over ASGI with CouchDB replaced by an in-memory
+httpx transport, so the numbers cover routing, header handling, JWT and
+token DB checks, admission and response relay - not the network.
+
+Usage:
+    python3 benchmarks/proxy_overhead.py [requests] [concurrency] [response-bytes] [--skip-token-db]
+
+--skip-token-db replaces the SQLite validity check and last-used write with
+no-ops, isolating framework and relay overhead from token DB cost.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENV_FILE", "/nonexistent")
+os.environ.setdefault("JWT_HMAC_SECRET", "benchmark-secret-benchmark-secret")
+os.environ.setdefault("COUCHDB_PASSWORD", "benchmark")
+os.environ.setdefault("TOKEN_DB_PATH", os.path.join(tempfile.mkdtemp(), "tokens.db"))
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+import main  # noqa: E402
+
+
+class PayloadStream(httpx.AsyncByteStream):
+    """Unread response body, like one coming off a real connection"""
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    async def __aiter__(self):
+        yield self.payload
+
+
+def mock_couchdb(response_bytes: int) -> httpx.MockTransport:
+    payload = b'{"_id":"doc","_rev":"1-abc","data":"' + b"x" * max(0, response_bytes - 40) + b'"}'
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json", "content-length": str(len(payload))},
+            stream=PayloadStream(payload)
+        )
+
+    return httpx.MockTransport(handler)
+
+
+async def call(app, method: str, path: str, headers: list, body: bytes = b"") -> int:
+    """Run one request through an ASGI app and return the status code"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 5985),
+    }
+    sent_body = False
+    disconnected = asyncio.Event()
+    status = {}
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+        elif not message.get("more_body", False):
+            disconnected.set()
+
+    await app(scope, receive, send)
+    return status.get("code", 0)
+
+
+async def run(total: int, concurrency: int, response_bytes: int, skip_token_db: bool):
+    await main.db.init_db()
+    token = await main.db.create_token("benchmark")
+    if skip_token_db:
+        async def valid(token_id):
+            return True
+
+        async def touch(token_id):
+            return None
+
+        main.db.is_token_valid = valid
+        main.db.update_last_used = touch
+
+    for node in main.upstreams.nodes:
+        node.client = httpx.AsyncClient(transport=mock_couchdb(response_bytes), auth=node.auth)
+        node.healthy = True
+
+    jwt_token = jwt.encode({"token_id": token["token_id"], "device_name": "benchmark"},
+                           main.JWT_SECRET, algorithm="HS256")
+    headers = [
+        (b"host", b"localhost"),
+        (b"authorization", f"Bearer {jwt_token}".encode()),
+        (b"accept", b"application/json"),
+        (b"user-agent", b"benchmark"),
+    ]
+
+    # Warm up connection pools, imports and caches
+    for _ in range(50):
+        await call(main.app, "GET", "/obsidian-sync/doc", headers)
+
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            started = time.perf_counter()
+            code = await call(main.app, "GET", "/obsidian-sync/doc", headers)
+            latencies.append(time.perf_counter() - started)
+            assert code == 200, code
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"requests:    {total} (concurrency {concurrency}, {response_bytes} byte responses"
+          f"{', token DB skipped' if skip_token_db else ''})")
+    print(f"throughput:  {total / elapsed:,.0f} req/s")
+    print(f"mean:        {statistics.mean(latencies) * 1e6:,.0f} µs")
+    print(f"p50:         {latencies[len(latencies) // 2] * 1e6:,.0f} µs")
+    print(f"p99:         {latencies[int(len(latencies) * 0.99)] * 1e6:,.0f} µs")
+
+
+if __name__ == "__main__":
+    skip_token_db = "--skip-token-db" in sys.argv
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    total = int(args[0]) if len(args) > 0 else 2000
+    concurrency = int(args[1]) if len(args) > 1 else 1
+    response_bytes = int(args[2]) if len(args) > 2 else 1024
+    asyncio.run(run(total, concurrency, response_bytes, skip_token_db))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Replay traffic captured by the proxy's recorder (TRAFFIC_RECORD_DIR)
+
+Reads traffic-*.ndjson.gz files, merges the workers' streams by request
+start time and re-issues every request against a target - normally a local
+CouchDB stand-in, or the proxy itself with --bearer - at the original pace
+or scaled by --speed. Recorded bodies are sent when they were captured in
+full; otherwise a JSON body of the recorded size is synthesized, so writes
+exercise the same byte volumes but not the same documents.
+
+Reports replayed vs recorded latency per endpoint and status agreement.
+
+Examples:
+    python3 benchmarks/replay_traffic.py /data/traffic --target http://127.0.0.1:5984 --user admin --password pw
+    python3 benchmarks/replay_traffic.py /data/traffic/traffic-*.ndjson.gz --speed 10 --concurrency 128
+    python3 benchmarks/replay_traffic.py /data/traffic --speed 0 --bearer "$JWT" --target http://127.0.0.1:5985
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import os
+import re
+import time
+from collections import defaultdict
+
+import httpx
+
+FILE_PATTERN = re.compile(r"^(traffic-.+-\d+)-(\d+)\.ndjson\.gz$")
+
+
+def find_files(inputs: list) -> dict:
+    """Recorder files grouped per worker (same prefix), each group in write order"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(glob.glob(os.path.join(item, "traffic-*.ndjson.gz")))
+        else:
+            paths.extend(glob.glob(item))
+
+    streams = defaultdict(list)
+    for path in paths:
+        match = FILE_PATTERN.match(os.path.basename(path))
+        if match:
+            streams[match.group(1)].append((int(match.group(2)), path))
+    return {prefix: [path for _, path in sorted(files)] for prefix, files in streams.items()}
+
+
+def read_lines(paths: list):
+    """Parsed records of one worker's files, stopping at the last complete one of each"""
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A file still being written can end mid-line
+                        continue
+            except EOFError:
+                # Gzip member never closed: the worker is still writing it, or was killed
+                continue
+
+
+def read_records(paths: list, window: float, stats: dict):
+    """
+    One worker's records in request start order
+
+    Records are written at completion, so a request that ran for d seconds
+    appears after everything that completed in the meantime. A heap holds
+    records until the stream's completion time has moved `window` seconds
+    past their start; requests longer than the window (rare: the default
+    matches COUCHDB_TIMEOUT) are replayed at the latest start already
+    emitted and counted in stats["late"].
+    """
+    pending = []
+    emitted = float("-inf")
+    sequence = itertools.count()
+    for record in read_lines(paths):
+        # Recorded at completion; replay at the original start
+        record["start"] = record["ts"] - record.get("duration_ms", 0) / 1000
+        if record["start"] < emitted:
+            stats["late"] += 1
+            record["start"] = emitted
+        heapq.heappush(pending, (record["start"], next(sequence), record))
+        while pending and pending[0][0] <= record["ts"] - window:
+            emitted = pending[0][0]
+            yield heapq.heappop(pending)[2]
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+def request_body(record: dict) -> bytes:
+    if record.get("body_truncated") is False:
+        if "body" in record:
+            return record["body"].encode("utf-8")
+        if "body_b64" in record:
+            return base64.b64decode(record["body_b64"])
+    size = record.get("bytes_in", 0)
+    if not size:
+        return b""
+    return b'{"pad":"' + b"x" * max(0, size - 10) + b'"}'
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def replay(args) -> dict:
+    streams = find_files(args.inputs)
+    if not streams:
+        raise SystemExit("No traffic-*.ndjson.gz files found")
+    ordering = {"late": 0}
+    records = heapq.merge(*(read_records(paths, args.reorder_window, ordering) for paths in streams.values()),
+                          key=lambda r: r["start"])
+    if args.limit:
+        records = itertools.islice(records, args.limit)
+
+    headers = {"Content-Type": "application/json"}
+    auth = None
+    if args.bearer:
+        headers["Authorization"] = f"Bearer {args.bearer}"
+    elif args.user:
+        auth = (args.user, args.password or "")
+
+    results = defaultdict(lambda: {"replayed": [], "recorded": [], "status_match": 0, "errors": 0})
+    slots = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    tasks = set()
+
+    async with httpx.AsyncClient(base_url=args.target, auth=auth, headers=headers, limits=limits,
+                                 timeout=args.timeout) as client:
+
+        async def issue(record: dict):
+            result = results[record.get("endpoint", "?")]
+            url = "/" + record["path"] + (f"?{record['query']}" if record.get("query") else "")
+            started = time.perf_counter()
+            try:
+                response = await client.request(record["method"], url, content=request_body(record))
+            except httpx.HTTPError:
+                result["errors"] += 1
+                return
+            finally:
+                slots.release()
+            result["replayed"].append(time.perf_counter() - started)
+            result["recorded"].append(record.get("duration_ms", 0) / 1000)
+            if response.status_code == record.get("status"):
+                result["status_match"] += 1
+
+        first_start = None
+        clock_start = time.monotonic()
+        for record in records:
+            if first_start is None:
+                first_start = record["start"]
+            if args.speed > 0:
+                due = clock_start + (record["start"] - first_start) / args.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await slots.acquire()
+            task = asyncio.create_task(issue(record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - clock_start
+
+    report = {"target": args.target, "speed": args.speed, "elapsed": elapsed,
+              "late": ordering["late"], "endpoints": {}}
+    for endpoint, result in sorted(results.items()):
+        replayed = sorted(result["replayed"])
+        recorded = sorted(result["recorded"])
+        report["endpoints"][endpoint] = {
+            "requests": len(replayed) + result["errors"],
+            "errors": result["errors"],
+            "status_match": result["status_match"] / len(replayed) if replayed else 0.0,
+            "replay_p50_ms": percentile(replayed, 0.50) * 1000,
+            "replay_p99_ms": percentile(replayed, 0.99) * 1000,
+            "recorded_p50_ms": percentile(recorded, 0.50) * 1000,
+            "recorded_p99_ms": percentile(recorded, 0.99) * 1000,
+        }
+    return report
+
+
+def print_report(report: dict):
+    total = sum(e["requests"] for e in report["endpoints"].values())
+    print(f"\nReplayed {total:,} requests against {report['target']} in {report['elapsed']:.1f}s "
+          f"({total / max(report['elapsed'], 1e-9):,.0f} req/s, speed {report['speed'] or 'max'})")
+    if report["late"]:
+        print(f"  {report['late']:,} requests ran longer than --reorder-window and were replayed late")
+    print(f"  {'endpoint':<14}{'requests':>10}{'errors':>8}{'status ok':>11}"
+          f"{'p50 ms':>10}{'p99 ms':>10}{'rec p50':>10}{'rec p99':>10}")
+    for name, e in report["endpoints"].items():
+        print(
+            f"  {name:<14}{e['requests']:>10,}{e['errors']:>8}{e['status_match']:>10.1%}"
+            f"{e['replay_p50_ms']:>10.2f}{e['replay_p99_ms']:>10.2f}"
+            f"{e['recorded_p50_ms']:>10.2f}{e['recorded_p99_ms']:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded LiveSync traffic")
+    parser.add_argument("inputs", nargs="+", help="recorder directories or file globs")
+    parser.add_argument("--target", default="http://127.0.0.1:5984", help="base URL to replay against")
+    parser.add_argument("--speed", type=float, default=1.0, help="pace multiplier; 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout (seconds)")
+    parser.add_argument("--reorder-window", type=float, default=300.0,
+                        help="longest recorded request (seconds) to put back in start order")
+    parser.add_argument("--user", default=None, help="Basic auth user (CouchDB stand-in)")
+    parser.add_argument("--password", default=None, help="Basic auth password")
+    parser.add_argument("--bearer", default=None, help="Bearer token (replaying through the proxy)")
+    parser.add_argument("--json", default=None, help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(replay(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
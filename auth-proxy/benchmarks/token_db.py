@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+TokenDatabase micro-benchmarks across table sizes and concurrent workers
+
+Seeds a synthetic device_tokens table (a mix of active, revoked and expired
+tokens), then drives the TokenDatabase API from several processes at once -
+the way multiple uvicorn workers share one SQLite file - and reports
+throughput, latency percentiles and 'database is locked' rates per operation.
+
+The storage class is pluggable (--db-class module:Class, constructed with
+db_path=...), so the same workload can compare SQLite settings or caching
+layers against the stock TokenDatabase.
+
+Examples:
+    python3 benchmarks/token_db.py
+    python3 benchmarks/token_db.py --sizes 1000,100000,1000000 --workers 1,2,4,8
+    python3 benchmarks/token_db.py --mix is_token_valid=1 --duration 5 --json results.json
+    python3 benchmarks/token_db.py --db-class my_cache:CachedTokenDatabase
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import secrets
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+OPERATIONS = ("is_token_valid", "update_last_used", "list_tokens", "cleanup_expired")
+DEFAULT_MIX = "is_token_valid=80,update_last_used=18,list_tokens=1,cleanup_expired=1"
+
+
+def load_db_class(spec: str):
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name or "TokenDatabase")
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in filter(None, spec.split(",")):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def seed(db_class, db_path: str, rows: int, revoked_ratio: float, expired_ratio: float, sample_size: int) -> list:
+    """
+    Create a table of `rows` synthetic tokens; return a sample of token_ids
+    to query (active, revoked, expired and a few unknown ids)
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    asyncio.run(db_class(db_path=db_path).init_db())
+
+    now = datetime.utcnow()
+    rng = random.Random(rows)
+    sample = []
+    conn = sqlite3.connect(db_path)
+    batch = []
+    for i in range(rows):
+        token_id = secrets.token_urlsafe(32)
+        created_at = (now - timedelta(days=rng.randint(0, 365))).isoformat()
+        roll = rng.random()
+        revoked, revoked_at, expires_at = 0, None, None
+        if roll < revoked_ratio:
+            revoked, revoked_at = 1, now.isoformat()
+        elif roll < revoked_ratio + expired_ratio:
+            expires_at = (now - timedelta(days=rng.randint(1, 30))).isoformat()
+        elif rng.random() < 0.5:
+            expires_at = (now + timedelta(days=rng.randint(1, 365))).isoformat()
+
+        batch.append((token_id, f"device-{i}", created_at, expires_at, revoked, revoked_at))
+        if len(sample) < sample_size:
+            sample.append(token_id)
+        elif rng.random() < sample_size / (i + 1):
+            sample[rng.randrange(sample_size)] = token_id
+
+        if len(batch) >= 10000:
+            conn.executemany(
+                "INSERT INTO device_tokens (token_id, device_name, created_at, expires_at, revoked, revoked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", batch
+            )
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO device_tokens (token_id, device_name, created_at, expires_at, revoked, revoked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", batch
+        )
+    conn.commit()
+    conn.close()
+
+    # A sliver of lookups for tokens that don't exist
+    sample.extend(secrets.token_urlsafe(32) for _ in range(max(1, sample_size // 100)))
+    return sample
+
+
+async def drive(db_class, db_path: str, mix: dict, token_ids: list, start_at: float, duration: float) -> dict:
+    db = db_class(db_path=db_path)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: {"latencies": [], "locked": 0, "errors": 0} for name in names}
+    rng = random.Random(os.getpid())
+
+    while time.time() < start_at:
+        await asyncio.sleep(0.001)
+
+    deadline = start_at + duration
+    while time.time() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            if name == "is_token_valid":
+                await db.is_token_valid(rng.choice(token_ids))
+            elif name == "update_last_used":
+                await db.update_last_used(rng.choice(token_ids))
+            elif name == "list_tokens":
+                await db.list_tokens(include_revoked=rng.random() < 0.5)
+            elif name == "cleanup_expired":
+                await db.cleanup_expired()
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                results[name]["locked"] += 1
+            else:
+                results[name]["errors"] += 1
+            continue
+        except Exception:
+            results[name]["errors"] += 1
+            continue
+        results[name]["latencies"].append(time.perf_counter() - started)
+
+    return results
+
+
+def worker_main(db_class_spec: str, db_path: str, mix: dict, token_ids: list,
+                start_at: float, duration: float, queue):
+    db_class = load_db_class(db_class_spec)
+    queue.put(asyncio.run(drive(db_class, db_path, mix, token_ids, start_at, duration)))
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_case(args, db_path: str, rows: int, workers: int, token_ids: list) -> dict:
+    mix = parse_mix(args.mix)
+    queue = multiprocessing.Queue()
+    # Give every process time to import and open the database before the clock starts
+    start_at = time.time() + 1.0 + 0.1 * workers
+    processes = [
+        multiprocessing.Process(
+            target=worker_main,
+            args=(args.db_class, db_path, mix, token_ids, start_at, args.duration, queue)
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    partials = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    report = {"rows": rows, "workers": workers, "duration": args.duration, "operations": {}}
+    for name in mix:
+        latencies = sorted(lat for part in partials for lat in part[name]["latencies"])
+        locked = sum(part[name]["locked"] for part in partials)
+        errors = sum(part[name]["errors"] for part in partials)
+        attempts = len(latencies) + locked + errors
+        report["operations"][name] = {
+            "ops": len(latencies),
+            "ops_per_sec": len(latencies) / args.duration,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+            "locked": locked,
+            "locked_rate": locked / attempts if attempts else 0.0,
+            "errors": errors,
+        }
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n{report['rows']:>9,} rows | {report['workers']} worker(s) | {report['duration']:.0f}s")
+    print(f"  {'operation':<18}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'locked':>9}{'errors':>8}")
+    for name, op in report["operations"].items():
+        print(
+            f"  {name:<18}{op['ops_per_sec']:>10,.0f}{op['p50_ms']:>10.2f}{op['p95_ms']:>10.2f}"
+            f"{op['p99_ms']:>10.2f}{op['max_ms']:>10.1f}{op['locked_rate']:>8.1%}{op['errors']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TokenDatabase micro-benchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated table sizes (rows)")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated process counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per case")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. is_token_valid=9,list_tokens=1")
+    parser.add_argument("--revoked", type=float, default=0.2, help="fraction of revoked tokens")
+    parser.add_argument("--expired", type=float, default=0.1, help="fraction of expired tokens")
+    parser.add_argument("--sample", type=int, default=10000, help="token ids sampled for lookups")
+    parser.add_argument("--db-class", default="database:TokenDatabase", help="storage class as module:Class")
+    parser.add_argument("--dir", default=None, help="directory for database files (default: temp dir)")
+    parser.add_argument("--json", default=None, help="write results to this JSON file")
+    args = parser.parse_args()
+
+    db_class = load_db_class(args.db_class)
+    work_dir = args.dir or tempfile.mkdtemp(prefix="token-db-bench-")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    worker_counts = [int(count) for count in args.workers.split(",")]
+
+    print(f"Storage: {args.db_class}  Mix: {args.mix}  Dir: {work_dir}")
+    reports = []
+    for rows in sizes:
+        db_path = os.path.join(work_dir, f"tokens-{rows}.db")
+        for workers in worker_counts:
+            # Reseed each case: cleanup_expired and update_last_used mutate the table
+            started = time.perf_counter()
+            token_ids = seed(db_class, db_path, rows, args.revoked, args.expired, args.sample)
+            print(f"Seeded {rows:,} rows in {time.perf_counter() - started:.1f}s", end="")
+            report = run_case(args, db_path, rows, workers, token_ids)
+            report["db_class"] = args.db_class
+            print_report(report)
+            reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Orphan chunk garbage collector for Obsidian LiveSync databases
+
+LiveSync stores note content as content-addressed chunk documents ("h:..."
+ids, type "leaf") referenced from file documents' `children` lists. With
+useHistory off, chunks dropped by later edits are never read again, but
+nothing deletes them. This tool finds and removes them:
+
+1. Mark   - stream file documents (any doc with `children`, including the
+            bodies of live conflicting revisions) from a continuous
+            _changes feed and record every referenced chunk id as a
+            64-bit hash.
+2. Sweep  - stream chunk ids and revisions (no bodies). Unreferenced
+            chunks are recorded as candidates in a state file; only those
+            that were already candidates (same revision) in a previous run
+            at least --grace-hours earlier are spooled for deletion.
+3. Delete - in bounded _bulk_docs batches (or _purge with --purge). Before
+            each batch, file changes made since the mark are applied, so
+            chunks referenced by edits made during the run are kept.
+
+The grace period exists because LiveSync uploads chunks before the file
+document that references them, in separate batches and possibly across an
+interrupted sync. Such a chunk looks orphaned until its note arrives;
+deleting it would replicate the tombstone to every device and corrupt the
+note. The first run (or one within the grace period) deletes nothing.
+
+Memory is the hash tables only (16 bytes per referenced chunk and per
+previous candidate at the default load factor), both within one --memory-mb.
+A hash collision can only keep an orphan, never delete a referenced chunk.
+
+Deleting leaves tombstones that replicate to devices so they drop their
+copies too. --purge removes chunks without tombstones, but devices still
+holding them may upload them again.
+
+Usage:
+    python3 chunk_gc.py                       # dry run on DB_NAME (records candidates)
+    python3 chunk_gc.py --db notes --report orphans.ndjson
+    python3 chunk_gc.py --apply               # delete orphans
+    python3 chunk_gc.py --apply --purge --batch-size 100
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from array import array
+from typing import Optional
+from urllib.parse import quote
+
+import httpx
+from dotenv import load_dotenv
+
+from couchdb_stream import ChangesFeed, couchdb_client, db_path, open_revs
+
+# Load environment variables from configurable path
+ENV_FILE = os.getenv("ENV_FILE", "/root/obsidian-livesync/.env")
+if os.path.exists(ENV_FILE):
+    load_dotenv(ENV_FILE)
+
+CHUNK_PREFIX = "h:"
+FILE_SELECTOR = {"children": {"$exists": True}}
+CHUNK_SELECTOR = {"type": "leaf"}
+# CouchDB rejects _purge requests naming more documents than this by default
+PURGE_MAX_DOCS = 100
+# Candidate state files live next to the token database (a persistent volume in Docker)
+STATE_DIR = os.path.dirname(os.getenv("TOKEN_DB_PATH", "")) or "."
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def chunk_hash(chunk_id: str) -> int:
+    """64-bit hash of a chunk id; 0 is reserved for empty slots"""
+    value = int.from_bytes(hashlib.blake2b(chunk_id.encode("utf-8"), digest_size=8).digest(), "little")
+    return value or 1
+
+
+def candidate_key(chunk_id: str, rev: str) -> int:
+    """Hash of one chunk revision; a re-uploaded chunk gets a new rev and starts over"""
+    return chunk_hash(f"{chunk_id} {rev}")
+
+
+def state_path(database: str, state_dir: str = STATE_DIR) -> str:
+    return os.path.join(state_dir, f"chunk_gc-{quote(database, safe='')}.ndjson")
+
+
+def load_candidates(path: str, database: str, max_bytes: int) -> tuple:
+    """
+    (created, HashSet64 of candidate keys) from a previous run's state file,
+    or (None, None) when there is none for this database
+
+    The file is a header line {"database", "created"} (when the mark
+    started) followed by one [chunk_id, rev] line per candidate.
+    """
+    try:
+        state = open(path)
+    except FileNotFoundError:
+        return None, None
+    with state:
+        header = json.loads(state.readline() or "{}")
+        if header.get("database") != database:
+            return None, None
+        candidates = HashSet64(max_bytes=max_bytes)
+        for line in state:
+            chunk_id, rev = json.loads(line)
+            candidates.add(candidate_key(chunk_id, rev))
+    return header["created"], candidates
+
+
+class HashSet64:
+    """
+    Open-addressing set of 64-bit integers in one array('Q')
+
+    Linear probing, grown by doubling at 50% load. About 16 bytes per
+    member versus ~100 for a set of id strings.
+    """
+
+    def __init__(self, expected: int = 0, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        size = 1024
+        while size < expected * 2:
+            size *= 2
+        while size > 1024 and size * 8 > max_bytes:
+            size //= 2
+        self._allocate(size)
+        self.count = 0
+
+    def _allocate(self, size: int):
+        self.slots = array("Q", bytes(8 * size))
+        self.mask = size - 1
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.slots) * 8
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, value: int):
+        slots, mask = self.slots, self.mask
+        i = value & mask
+        while True:
+            current = slots[i]
+            if current == 0:
+                slots[i] = value
+                self.count += 1
+                if self.count * 2 > len(slots):
+                    self._grow()
+                return
+            if current == value:
+                return
+            i = (i + 1) & mask
+
+    def __contains__(self, value: int) -> bool:
+        slots, mask = self.slots, self.mask
+        i = value & mask
+        while True:
+            current = slots[i]
+            if current == value:
+                return True
+            if current == 0:
+                return False
+            i = (i + 1) & mask
+
+    def _grow(self):
+        # Old and new tables coexist while rehashing
+        if self.nbytes * 3 > self.max_bytes:
+            raise MemoryBudgetExceeded(
+                f"{self.count:,} chunk hashes need more than {self.max_bytes // (1024 * 1024)} MB"
+            )
+        old = self.slots
+        self._allocate(len(old) * 2)
+        self.count = 0
+        for value in old:
+            if value:
+                self.add(value)
+
+
+class ChunkCollector:
+    def __init__(self, client: httpx.Client, database: str, batch_size: int = 500,
+                 memory_bytes: int = 256 * 1024 * 1024, spool_dir: str = None):
+        self.client = client
+        self.database = database
+        self.batch_size = batch_size
+        self.spool_dir = spool_dir
+
+        info = client.get(db_path(database))
+        info.raise_for_status()
+        self.doc_count = info.json().get("doc_count", 0)
+        self.referenced = HashSet64(self.doc_count, memory_bytes)
+        # Previous run's candidates past the grace period; None deletes nothing
+        self.candidates: Optional[HashSet64] = None
+        self.seq = "0"
+        self.stats = {
+            "file_docs": 0,
+            "conflicted_file_docs": 0,
+            "chunk_docs": 0,
+            "candidates": 0,
+            "orphans": 0,
+            "rescued": 0,
+            "deleted": 0,
+            "failed": 0,
+        }
+
+    def _mark_doc(self, change: dict):
+        doc = change.get("doc") or {}
+        for chunk_id in doc.get("children") or ():
+            self.referenced.add(chunk_hash(chunk_id))
+
+        # Every live conflicting revision may still win - keep their chunks too.
+        # _conflicts skips deleted leaves (conflicts that were already resolved).
+        other_revs = doc.get("_conflicts") or []
+        if other_revs:
+            self.stats["conflicted_file_docs"] += 1
+            for revision in open_revs(self.client, self.database, change["id"], other_revs):
+                for chunk_id in revision.get("children") or ():
+                    self.referenced.add(chunk_hash(chunk_id))
+
+    def mark(self, since: str = "0", idle_timeout: float = 1.0) -> int:
+        """Add chunks referenced by file docs changed since `since`; return docs seen"""
+        feed = ChangesFeed(self.client, self.database, since=since, selector=FILE_SELECTOR,
+                           include_docs=True, conflicts=True, idle_timeout=idle_timeout)
+        seen = 0
+        for change in feed:
+            seen += 1
+            self._mark_doc(change)
+        self.seq = feed.last_seq
+        return seen
+
+    def sweep(self, spool, state=None) -> int:
+        """
+        Record unreferenced chunk (id, rev) pairs to `state` as candidates for
+        the next run, and write those that were already candidates to `spool`;
+        return how many were spooled
+        """
+        feed = ChangesFeed(self.client, self.database, selector=CHUNK_SELECTOR, all_revs=True)
+        orphans = 0
+        for change in feed:
+            if change.get("deleted") or not change["id"].startswith(CHUNK_PREFIX):
+                continue
+            self.stats["chunk_docs"] += 1
+            if chunk_hash(change["id"]) in self.referenced:
+                continue
+            for c in change.get("changes", ()):
+                entry = json.dumps([change["id"], c["rev"]]) + "\n"
+                self.stats["candidates"] += 1
+                if state:
+                    state.write(entry)
+                if self.candidates is not None and candidate_key(change["id"], c["rev"]) in self.candidates:
+                    spool.write(entry)
+                    orphans += 1
+        return orphans
+
+    def _delete(self, batch: list, purge: bool):
+        if purge:
+            request = {}
+            for chunk_id, rev in batch:
+                request.setdefault(chunk_id, []).append(rev)
+            response = self.client.post(f"{db_path(self.database)}/_purge", json=request)
+            response.raise_for_status()
+            purged = response.json().get("purged", {})
+            done = sum(len(revs) for revs in purged.values())
+            self.stats["deleted"] += done
+            self.stats["failed"] += len(batch) - done
+            return
+
+        docs = [{"_id": chunk_id, "_rev": rev, "_deleted": True} for chunk_id, rev in batch]
+        response = self.client.post(f"{db_path(self.database)}/_bulk_docs", json={"docs": docs})
+        response.raise_for_status()
+        for row in response.json():
+            if row.get("ok"):
+                self.stats["deleted"] += 1
+            else:
+                self.stats["failed"] += 1
+
+    def collect(self, spool, apply: bool, purge: bool = False, report=None):
+        """Re-check spooled orphans against fresh file changes, then delete them in batches"""
+        batch_size = min(self.batch_size, PURGE_MAX_DOCS) if purge else self.batch_size
+        spool.seek(0)
+        while True:
+            batch = [json.loads(line) for _, line in zip(range(batch_size), spool)]
+            if not batch:
+                return
+            # Edits made since the mark may reference chunks we are about to drop
+            self.mark(self.seq, idle_timeout=0.05)
+            keep = [entry for entry in batch if chunk_hash(entry[0]) not in self.referenced]
+            self.stats["rescued"] += len(batch) - len(keep)
+            if report:
+                for chunk_id, rev in keep:
+                    report.write(json.dumps({"id": chunk_id, "rev": rev}) + "\n")
+            if apply and keep:
+                self._delete(keep, purge)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete unreferenced LiveSync chunk documents")
+    parser.add_argument("--db", default=os.getenv("DB_NAME", "obsidian-sync"), help="database (default: DB_NAME)")
+    parser.add_argument("--couchdb-url", default=None, help="CouchDB URL (default: COUCHDB_URL / COUCHDB_HOST:PORT)")
+    parser.add_argument("--apply", action="store_true", help="delete orphans (default: dry run)")
+    parser.add_argument("--purge", action="store_true", help="purge instead of delete (no tombstones)")
+    parser.add_argument("--batch-size", type=int, default=500, help="documents per _bulk_docs/_purge call")
+    parser.add_argument("--memory-mb", type=int, default=256, help="memory budget for referenced and candidate chunk hashes")
+    parser.add_argument("--spool-dir", default=None, help="directory for the orphan spool file")
+    parser.add_argument("--report", default=None, help="write orphan ids and revs as NDJSON to this file")
+    parser.add_argument("--grace-hours", type=float, default=24.0,
+                        help="only delete chunks already unreferenced in a run at least this long ago")
+    parser.add_argument("--state", default=None,
+                        help=f"candidate state file (default: {STATE_DIR}/chunk_gc-<db>.ndjson)")
+    args = parser.parse_args()
+
+    # One budget for both tables: the candidates are loaded first and the
+    # referenced chunks get what they leave
+    memory_bytes = args.memory_mb * 1024 * 1024
+    path = args.state or state_path(args.db)
+    try:
+        created, candidates = load_candidates(path, args.db, memory_bytes)
+    except MemoryBudgetExceeded as e:
+        print(f"❌ {e}; raise --memory-mb. Nothing was deleted.")
+        sys.exit(1)
+    # A run inside the grace period keeps the older state so its clock keeps running
+    keep_state = created is not None and time.time() - created < args.grace_hours * 3600
+    if created is None or keep_state:
+        candidates = None
+
+    client = couchdb_client(args.couchdb_url)
+    try:
+        collector = ChunkCollector(client, args.db, args.batch_size,
+                                   memory_bytes - (candidates.nbytes if candidates else 0), args.spool_dir)
+    except httpx.HTTPError as e:
+        print(f"❌ Cannot open database {args.db}: {e}")
+        sys.exit(1)
+    collector.candidates = candidates
+
+    mode = "purge" if args.purge else "delete"
+    print(f"🧹 Chunk GC on {args.db} ({collector.doc_count:,} docs) - {mode if args.apply else 'dry run'}")
+    if created is None:
+        print("   No previous candidates - recording this run's; nothing is deleted until a later run")
+    elif keep_state:
+        print(f"   Previous candidates are {(time.time() - created) / 3600:.1f}h old "
+              f"(grace {args.grace_hours:g}h) - nothing is deleted this run")
+
+    started = time.monotonic()
+    snapshot_time = time.time()
+    try:
+        collector.stats["file_docs"] = collector.mark()
+    except MemoryBudgetExceeded as e:
+        print(f"❌ {e}; raise --memory-mb. Nothing was deleted.")
+        sys.exit(1)
+    print(f"   Marked {len(collector.referenced):,} referenced chunks from {collector.stats['file_docs']:,} "
+          f"file docs ({collector.referenced.nbytes / 1024 / 1024:.0f} MB hash table)")
+
+    state = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    try:
+        state.write(json.dumps({"database": args.db, "created": snapshot_time}) + "\n")
+        with tempfile.TemporaryFile("w+", dir=args.spool_dir) as spool:
+            collector.stats["orphans"] = collector.sweep(spool, state)
+            state.close()
+            print(f"   Swept {collector.stats['chunk_docs']:,} chunks, {collector.stats['candidates']:,} unreferenced, "
+                  f"{collector.stats['orphans']:,} of them past the grace period")
+
+            report = open(args.report, "w") if args.report else None
+            try:
+                collector.collect(spool, args.apply, args.purge, report)
+            finally:
+                if report:
+                    report.close()
+        if not keep_state:
+            os.replace(state.name, path)
+    finally:
+        state.close()
+        if os.path.exists(state.name):
+            os.unlink(state.name)
+
+    stats = collector.stats
+    print(f"\n✅ Done in {time.monotonic() - started:.1f}s")
+    print(f"   Conflicted file docs:  {stats['conflicted_file_docs']:,}")
+    print(f"   Candidates recorded:   {stats['candidates']:,}{' (state kept)' if keep_state else ''}")
+    print(f"   Orphans past grace:    {stats['orphans']:,}")
+    print(f"   Re-referenced in run:  {stats['rescued']:,}")
+    if args.apply:
+        print(f"   {mode.capitalize()}d:{' ' * (21 - len(mode))}{stats['deleted']:,}")
+        print(f"   Failed:                {stats['failed']:,}")
+    else:
+        print(f"   Would {mode}:{' ' * (16 - len(mode))}{stats['orphans'] - stats['rescued']:,}")
+        print("   Re-run with --apply to remove them.")
+    if args.report:
+        print(f"   Orphan list: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,11 +34,13 @@ HEADERS = {
 }
 
 
-def create_token(device_name: str, expires_in_days: int = None):
+def create_token(device_name: str, expires_in_days: int = None, databases: list = None):
     """Create a new device token"""
     params = {"device_name": device_name}
     if expires_in_days:
         params["expires_in_days"] = expires_in_days
+    if databases:
+        params["databases"] = ",".join(databases)
 
     response = requests.post(f"{API_BASE}/tokens/create", headers=HEADERS, params=params)
 
@@ -50,6 +52,8 @@ def create_token(device_name: str, expires_in_days: int = None):
         print(f"📅 Created: {data['created_at']}")
         if data['expires_at']:
             print(f"⏰ Expires: {data['expires_at']}")
+        if data.get('allowed_databases'):
+            print(f"🗄️  Databases: {', '.join(data['allowed_databases'])}")
         print(f"\n🎫 JWT Token:")
         print(f"{data['jwt_token']}")
         print(f"\n📋 Usage in Obsidian:")
@@ -89,6 +93,8 @@ def list_tokens(include_revoked: bool = False):
                     print(f"  Expires: {token['expires_at']}")
             else:
                 print(f"  Expires: Never")
+            if token.get('allowed_databases'):
+                print(f"  Databases: {', '.join(token['allowed_databases'])}")
             if token['last_used_at']:
                 print(f"  Last used: {token['last_used_at']}")
             if token['revoked_at']:
@@ -137,6 +143,7 @@ def get_token_info(token_id: str):
             print(f"Expires: {token['expires_at']}")
         else:
             print(f"Expires: Never")
+        print(f"Databases: {', '.join(token['allowed_databases']) if token.get('allowed_databases') else 'all'}")
         if token['last_used_at']:
             print(f"Last used: {token['last_used_at']}")
         if token['revoked_at']:
@@ -166,7 +173,9 @@ def show_help():
 Obsidian LiveSync Token Management CLI
 
 Usage:
-    ./cli.py create <device-name> [days]    Create a new device token
+    ./cli.py create <device-name> [days] [--db NAME]...
+                                            Create a new device token, optionally
+                                            limited to the given databases
     ./cli.py list [--all]                   List active tokens (--all includes revoked)
     ./cli.py info <token-id>                Get token information
     ./cli.py revoke <token-id>              Revoke a token
@@ -176,6 +185,7 @@ Usage:
 Examples:
     ./cli.py create "iPhone"                Create token for iPhone (never expires)
     ./cli.py create "Laptop" 365            Create token that expires in 365 days
+    ./cli.py create "iPad" --db alice-notes Create token that can only reach alice-notes
     ./cli.py list                           List all active tokens
     ./cli.py list --all                     List all tokens including revoked
     ./cli.py revoke abc123                  Revoke token with ID abc123
@@ -192,13 +202,22 @@ def main():
     command = sys.argv[1]
 
     if command == "create":
-        if len(sys.argv) < 3:
-            print("❌ Usage: ./cli.py create <device-name> [days]")
+        args = []
+        databases = []
+        argv = iter(sys.argv[2:])
+        for arg in argv:
+            if arg == "--db":
+                databases.append(next(argv, ""))
+            else:
+                args.append(arg)
+
+        if not args:
+            print("❌ Usage: ./cli.py create <device-name> [days] [--db NAME]...")
             sys.exit(1)
 
-        device_name = sys.argv[2]
-        expires_in_days = int(sys.argv[3]) if len(sys.argv) > 3 else None
-        create_token(device_name, expires_in_days)
+        device_name = args[0]
+        expires_in_days = int(args[1]) if len(args) > 1 else None
+        create_token(device_name, expires_in_days, databases)
 
     elif command == "list":
         include_revoked = "--all" in sys.argv
@@ -0,0 +1,109 @@
+"""
+Streaming reads of large CouchDB databases for offline tools
+Continuous _changes feeds parsed one line (one change) at a time, so memory
+stays flat no matter how many documents the database holds
+"""
+import json
+import os
+from typing import Iterator, Optional
+from urllib.parse import quote
+
+import httpx
+
+
+def couchdb_client(url: Optional[str] = None, timeout: float = 300.0) -> httpx.Client:
+    """Synchronous CouchDB client using the auth proxy's COUCHDB_* settings"""
+    if url is None:
+        host = os.getenv("COUCHDB_HOST", "127.0.0.1")
+        port = os.getenv("COUCHDB_PORT", "5984")
+        url = os.getenv("COUCHDB_URL", f"http://{host}:{port}")
+    return httpx.Client(
+        base_url=url.rstrip("/"),
+        auth=(os.getenv("COUCHDB_USER", "admin"), os.getenv("COUCHDB_PASSWORD") or ""),
+        timeout=httpx.Timeout(timeout, connect=10.0),
+    )
+
+
+def db_path(database: str) -> str:
+    """URL path of a database ("team/notes" -> /team%2Fnotes)"""
+    return "/" + quote(database, safe="")
+
+
+class ChangesFeed:
+    """
+    Iterate a database's changes without buffering the response
+
+    Uses feed=continuous, where CouchDB writes one JSON object per line and
+    ends the response with a last_seq line after `idle_timeout` seconds
+    without new changes. An optional Mango selector filters server-side
+    (filter=_selector), so unneeded documents never cross the wire.
+    After iteration, last_seq holds the sequence to resume from.
+    """
+
+    def __init__(
+        self,
+        client: httpx.Client,
+        database: str,
+        since: str = "0",
+        selector: Optional[dict] = None,
+        include_docs: bool = False,
+        all_revs: bool = False,
+        conflicts: bool = False,
+        idle_timeout: float = 1.0,
+        limit: Optional[int] = None
+    ):
+        self.client = client
+        self.database = database
+        self.since = since
+        self.selector = selector
+        self.include_docs = include_docs
+        self.all_revs = all_revs
+        self.conflicts = conflicts
+        self.idle_timeout = idle_timeout
+        self.limit = limit
+        self.last_seq = since
+
+    def __iter__(self) -> Iterator[dict]:
+        params = {
+            "feed": "continuous",
+            "since": self.since,
+            "timeout": int(self.idle_timeout * 1000),
+        }
+        if self.include_docs:
+            params["include_docs"] = "true"
+        if self.all_revs:
+            params["style"] = "all_docs"
+        if self.conflicts:
+            params["conflicts"] = "true"
+        if self.limit:
+            params["limit"] = self.limit
+
+        request = {"params": params}
+        method = "GET"
+        if self.selector is not None:
+            params["filter"] = "_selector"
+            method = "POST"
+            request["json"] = {"selector": self.selector}
+
+        with self.client.stream(method, f"{db_path(self.database)}/_changes", **request) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                change = json.loads(line)
+                if "last_seq" in change:
+                    self.last_seq = change["last_seq"]
+                    return
+                self.last_seq = change.get("seq", self.last_seq)
+                yield change
+
+
+def open_revs(client: httpx.Client, database: str, doc_id: str, revs: list) -> list:
+    """Bodies of specific leaf revisions of a document (e.g. its conflicts)"""
+    response = client.get(
+        f"{db_path(database)}/{quote(doc_id, safe='')}",
+        params={"open_revs": json.dumps(revs)},
+        headers={"Accept": "application/json"},
+    )
+    response.raise_for_status()
+    return [item["ok"] for item in response.json() if "ok" in item]
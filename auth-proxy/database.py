@@ -2,6 +2,8 @@
 Async SQLite database for device token management
 """
 import os
+import sqlite3
+from contextlib import closing
 import aiosqlite
 import secrets
 from datetime import datetime, timedelta
@@ -9,6 +11,23 @@ from typing import Optional, List, Dict
 from pathlib import Path
 
 
+def _token_row(row) -> Dict:
+    """Row as a dict, with allowed_databases split into a list (None = unrestricted)"""
+    token = dict(row)
+    if token.get("allowed_databases"):
+        token["allowed_databases"] = token["allowed_databases"].split(",")
+    else:
+        token["allowed_databases"] = None
+    return token
+
+
+def _list_tokens_query(include_revoked: bool) -> str:
+    query = "SELECT * FROM device_tokens"
+    if not include_revoked:
+        query += " WHERE revoked = 0"
+    return query + " ORDER BY created_at DESC"
+
+
 class TokenDatabase:
     def __init__(self, db_path: str = None):
         # Use environment variable or fallback to default
@@ -20,6 +39,9 @@ class TokenDatabase:
     async def init_db(self):
         """Initialize database schema"""
         async with aiosqlite.connect(self.db_path) as db:
+            # WAL lets last_used writes commit while a long admin read
+            # (listing every token) is in progress; persists in the file
+            await db.execute("PRAGMA journal_mode=WAL")
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS device_tokens (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,10 +52,17 @@ class TokenDatabase:
                     last_used_at TEXT,
                     revoked INTEGER DEFAULT 0,
                     revoked_at TEXT,
-                    metadata TEXT
+                    metadata TEXT,
+                    allowed_databases TEXT
                 )
             """)
 
+            # Migrate tables created before database scoping
+            async with db.execute("PRAGMA table_info(device_tokens)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if "allowed_databases" not in columns:
+                await db.execute("ALTER TABLE device_tokens ADD COLUMN allowed_databases TEXT")
+
             await db.execute("""
                 CREATE INDEX IF NOT EXISTS idx_token_id ON device_tokens(token_id)
             """)
@@ -48,9 +77,10 @@ class TokenDatabase:
         self,
         device_name: str,
         expires_in_days: Optional[int] = None,
-        metadata: Optional[str] = None
+        metadata: Optional[str] = None,
+        allowed_databases: Optional[List[str]] = None
     ) -> Dict:
-        """Create a new device token"""
+        """Create a new device token, optionally limited to allowed_databases"""
         token_id = secrets.token_urlsafe(32)
         created_at = datetime.utcnow().isoformat()
         expires_at = None
@@ -61,9 +91,12 @@ class TokenDatabase:
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute("""
                 INSERT INTO device_tokens
-                (token_id, device_name, created_at, expires_at, metadata)
-                VALUES (?, ?, ?, ?, ?)
-            """, (token_id, device_name, created_at, expires_at, metadata))
+                (token_id, device_name, created_at, expires_at, metadata, allowed_databases)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                token_id, device_name, created_at, expires_at, metadata,
+                ",".join(allowed_databases) if allowed_databases else None
+            ))
 
             await db.commit()
 
@@ -72,7 +105,8 @@ class TokenDatabase:
             "device_name": device_name,
             "created_at": created_at,
             "expires_at": expires_at,
-            "metadata": metadata
+            "metadata": metadata,
+            "allowed_databases": allowed_databases or None
         }
 
     async def get_token(self, token_id: str) -> Optional[Dict]:
@@ -85,7 +119,7 @@ class TokenDatabase:
             ) as cursor:
                 row = await cursor.fetchone()
                 if row:
-                    return dict(row)
+                    return _token_row(row)
                 return None
 
     async def is_token_valid(self, token_id: str) -> bool:
@@ -131,16 +165,19 @@ class TokenDatabase:
 
     async def list_tokens(self, include_revoked: bool = False) -> List[Dict]:
         """List all tokens"""
-        query = "SELECT * FROM device_tokens"
-        if not include_revoked:
-            query += " WHERE revoked = 0"
-        query += " ORDER BY created_at DESC"
-
         async with aiosqlite.connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
-            async with db.execute(query) as cursor:
+            async with db.execute(_list_tokens_query(include_revoked)) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                return [_token_row(row) for row in rows]
+
+    def list_tokens_sync(self, include_revoked: bool = False) -> List[Dict]:
+        """List all tokens (blocking - for executor threads)"""
+        # sqlite3's own context manager only ends the transaction; closing() releases the handle
+        with closing(sqlite3.connect(self.db_path)) as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute(_list_tokens_query(include_revoked)).fetchall()
+        return [_token_row(row) for row in rows]
 
     async def delete_token(self, token_id: str) -> bool:
         """Permanently delete a token"""
@@ -0,0 +1,99 @@
+"""
+Managed executors that keep blocking work off the event loop
+A bounded thread pool for token database work and a process pool for
+CPU-heavy crypto and serialization
+"""
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from metrics import metrics
+
+
+class BoundedPool:
+    """
+    An executor with a cap on submitted work
+
+    At most max_pending calls are handed to the executor at once; further
+    callers wait on the event loop, so a burst of admin requests queues
+    cheaply instead of piling work into the executor's unbounded queue.
+    """
+
+    def __init__(self, name: str, factory: Callable, max_pending: int):
+        self.name = name
+        self._factory = factory
+        self._executor = None
+        self._slots = asyncio.Semaphore(max_pending)
+        self.active = 0
+        self.waiting = 0
+
+        self.completed = metrics.counter(f"executor_{name}_tasks_total", f"Tasks run on the {name} executor")
+        metrics.gauge(f"executor_{name}_active", f"Tasks running or queued in the {name} executor",
+                      lambda: self.active)
+        metrics.gauge(f"executor_{name}_waiting", f"Tasks waiting for a {name} executor slot",
+                      lambda: self.waiting)
+
+    @property
+    def executor(self):
+        # Created on first use: workers (and their processes) cost nothing until needed
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.active -= 1
+            self.completed.inc()
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+class Executors:
+    """
+    Per-worker executors for the proxy app
+
+    db  - threads for blocking token database calls and building their
+          (possibly large) JSON payloads
+    cpu - spawned processes for work that holds the GIL for long, such as
+          PBKDF2 when generating setup URIs. Arguments and results are
+          pickled, so only hand it work that is expensive relative to its
+          input and output size.
+    """
+
+    def __init__(self, db_threads: int = 4, cpu_processes: int = 2, max_pending: Optional[int] = None):
+        self.db = BoundedPool(
+            "db",
+            lambda: ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="db"),
+            max_pending or db_threads * 4
+        )
+        self.cpu = BoundedPool(
+            "cpu",
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            lambda: ProcessPoolExecutor(max_workers=cpu_processes, mp_context=multiprocessing.get_context("spawn")),
+            max_pending or cpu_processes * 4
+        )
+
+    async def run_db(self, fn: Callable, *args, **kwargs):
+        return await self.db.run(fn, *args, **kwargs)
+
+    async def run_cpu(self, fn: Callable, *args, **kwargs):
+        return await self.cpu.run(fn, *args, **kwargs)
+
+    def shutdown(self):
+        self.db.shutdown()
+        self.cpu.shutdown()
@@ -0,0 +1,178 @@
+"""
+Hedged upstream requests for small, latency-sensitive reads
+A duplicate request goes out when the first is slower than a live latency
+percentile; the first response wins and the other is cancelled
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from metrics import metrics
+
+# Endpoint labels (see timing.endpoint_label) eligible for hedging
+HEDGE_ENDPOINTS = ("doc", "_local")
+
+
+def hedge_kind(method: str, path: str) -> Optional[str]:
+    """
+    Hedging class of a request: "doc" for single-document GET/HEAD,
+    "_local" for checkpoint reads, None when it must not be duplicated
+    """
+    if method not in ("GET", "HEAD"):
+        return None
+    parts = path.strip("/").split("/")
+    if len(parts) == 2 and parts[1] and not parts[1].startswith("_"):
+        return "doc"
+    if len(parts) == 3 and parts[1] == "_local":
+        return "_local"
+    return None
+
+
+class LatencyWindow:
+    """
+    Recent response times of one endpoint and the hedge delay derived from them
+
+    Keeps the last `size` samples; the percentile is recomputed every
+    `refresh` samples rather than per request.
+    """
+
+    def __init__(self, percentile: float, size: int = 1000, min_samples: int = 100,
+                 refresh: int = 50, min_delay: float = 0.005):
+        self.percentile = percentile
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self.min_delay = min_delay
+        self.delay: Optional[float] = None
+        self._since_refresh = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh and len(self.samples) >= self.min_samples:
+            self._since_refresh = 0
+            ordered = sorted(self.samples)
+            value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+            self.delay = max(self.min_delay, value)
+
+
+class HedgePolicy:
+    """
+    When to hedge, and a token bucket capping hedges to a share of traffic
+
+    Every eligible request deposits `budget_ratio` tokens and every hedge
+    spends one, so duplicates add at most budget_ratio extra load even if
+    CouchDB slows down across the board. No hedging happens until an
+    endpoint has enough samples to know its percentile.
+    """
+
+    def __init__(self, percentile: float = 0.95, budget_ratio: float = 0.05,
+                 min_delay: float = 0.005, capacity: float = 20.0):
+        self.budget_ratio = budget_ratio
+        self.capacity = capacity
+        self.tokens = 0.0
+        self.windows: Dict[str, LatencyWindow] = {
+            kind: LatencyWindow(percentile, min_delay=min_delay) for kind in HEDGE_ENDPOINTS
+        }
+
+        self.eligible = metrics.counter("hedge_eligible_total", "Requests that could be hedged")
+        self.hedged = metrics.counter("hedge_requests_total", "Duplicate requests sent")
+        self.wins = metrics.counter("hedge_wins_total", "Hedges that answered first")
+        self.exhausted = metrics.counter("hedge_budget_exhausted_total", "Hedges skipped for lack of budget")
+        metrics.gauge("hedge_budget", "Hedge tokens available", lambda: int(self.tokens))
+        for kind, window in self.windows.items():
+            metrics.gauge(f"hedge_delay_seconds_{kind.lstrip('_')}", f"Current hedge delay for {kind} reads",
+                          lambda window=window: window.delay or 0.0)
+
+    def delay(self, kind: str) -> Optional[float]:
+        """Count an eligible request; its hedge delay, or None while still learning"""
+        self.eligible.inc()
+        self.tokens = min(self.capacity, self.tokens + self.budget_ratio)
+        return self.windows[kind].delay
+
+    def observe(self, kind: str, seconds: float):
+        self.windows[kind].observe(seconds)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.hedged.inc()
+            return True
+        self.exhausted.inc()
+        return False
+
+    def snapshot(self) -> dict:
+        return {
+            "budget": round(self.tokens, 2),
+            "eligible": self.eligible.value,
+            "hedged": self.hedged.value,
+            "wins": self.wins.value,
+            "delays_ms": {
+                kind: round(window.delay * 1000, 2) if window.delay else None
+                for kind, window in self.windows.items()
+            },
+        }
+
+
+async def _discard(task: asyncio.Task):
+    """Cancel a losing attempt and close its response if it already has one"""
+    if not task.done():
+        task.cancel()
+    try:
+        response = await task
+    except BaseException:
+        return
+    await response.aclose()
+
+
+async def race(
+    policy: HedgePolicy,
+    kind: str,
+    delay: float,
+    first: Callable[[], Awaitable[httpx.Response]],
+    second: Callable[[], Awaitable[httpx.Response]]
+) -> httpx.Response:
+    """
+    Start `first`; if it has not answered after `delay` and the budget
+    allows, start `second` too. Returns the first response; raises only
+    when every started attempt failed (the last error).
+
+    Records the latency of `first` alone for `kind`: the winner's time
+    would drag the percentile down. When `first` loses, the time it had
+    waited so far is recorded - already above the delay, which is all
+    the percentile needs.
+    """
+    started = time.monotonic()
+    primary = asyncio.ensure_future(first())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not policy.try_spend():
+        response = await primary
+        policy.observe(kind, time.monotonic() - started)
+        return response
+
+    backup = asyncio.ensure_future(second())
+    pending = {primary, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Prefer the original when both land in the same iteration
+            for task in sorted(done, key=lambda t: t is backup):
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                policy.observe(kind, time.monotonic() - started)
+                if task is backup:
+                    policy.wins.inc()
+                for other in (primary, backup):
+                    if other is not task:
+                        await _discard(other)
+                return task.result()
+        raise error
+    except BaseException:
+        for task in (primary, backup):
+            await _discard(task)
+        raise
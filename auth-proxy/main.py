@@ -1,17 +1,41 @@
 """
-FastAPI async authentication proxy for Obsidian LiveSync
+Async authentication proxy for Obsidian LiveSync
 Provides JWT-based per-device token authentication with revocation
+
+CouchDB traffic is handled by a raw ASGI fast path; FastAPI only serves
+the management API and health check.
 """
+import asyncio
+import base64
+import hmac
+import json
 import os
+import time
+from urllib.parse import quote, unquote
 import jwt
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import FastAPI, Request, HTTPException, Depends, Header
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import httpx
 from dotenv import load_dotenv
 from database import TokenDatabase
+from upstream import (
+    CouchDBUpstream, UpstreamPool, CircuitBreaker, CircuitOpenError,
+    is_live_feed, is_replicated_write
+)
+from admission import AdaptiveLimiter, AdmissionRejected, BodyLimits, classify_request, parse_class_config
+from metrics import metrics
+from profiler import SamplingProfiler, LoopLagMonitor
+from timing import RequestTimer, SlowRequestLog, connect_tracer, endpoint_label
+from hedge import HedgePolicy, hedge_kind, race
+from retry import RETRYABLE_ERRORS, RetryBudget, SpooledBody, backoff_delay, is_retry_safe
+from scopes import parse_databases, path_allowed
+from recorder import TrafficRecorder
+from executors import Executors
+from setup_uri import couchdb_location, generate_setup_uri
+from tuning import TUNING_PROFILES, SyncStats, tuning_profile
 
 # Load environment variables from configurable path
 ENV_FILE = os.getenv("ENV_FILE", "/root/obsidian-livesync/.env")
@@ -21,7 +45,7 @@ else:
     # Docker mode - ENV vars passed directly
     pass
 
-app = FastAPI(
+api = FastAPI(
     title="Obsidian LiveSync Auth Proxy",
     description="Custom JWT authentication with per-device token management",
     version="1.0.0"
@@ -40,31 +64,221 @@ JWT_SECRET = os.getenv("JWT_HMAC_SECRET")
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # For management API
 TOKEN_DB_PATH = os.getenv("TOKEN_DB_PATH", "/root/obsidian-livesync/auth-proxy/tokens.db")
 
+# Setup URI target (what devices will connect to)
+PUBLIC_URL = os.getenv("PUBLIC_URL", "https://obsidian.example.com")
+SYNC_USER = os.getenv("SYNC_USER", "obsidian")
+DB_NAME = os.getenv("DB_NAME", "obsidian-sync")
+
+# Executors for blocking token DB work and CPU-heavy crypto (per worker process)
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+CPU_PROCESSES = int(os.getenv("CPU_PROCESSES", "2"))
+
+# Deployment mode, shared with nginx: "proxy" sends all traffic through this app,
+# "offload" has nginx proxy bodies straight to CouchDB and only ask
+# /_auth/verify for a decision (auth_request)
+AUTH_MODE = os.getenv("AUTH_MODE", "proxy").lower()
+AUTH_OFFLOAD = AUTH_MODE == "offload"
+AUTH_VERIFY_PATH = "/_auth/verify"
+# nginx sets this header on its internal auth_request subrequest only;
+# /_auth/verify refuses every request without it
+AUTH_VERIFY_SECRET = os.getenv("AUTH_VERIFY_SECRET", "")
+# Public path prefix nginx strips before CouchDB sees the request (X-Original-URI has it)
+AUTH_OFFLOAD_PREFIX = os.getenv("AUTH_OFFLOAD_PREFIX", "/obsidian/")
+
+# Tokens created without allowed databases may reach every database unless this is set
+REQUIRE_DB_SCOPE = os.getenv("REQUIRE_DB_SCOPE", "false").lower() in ("1", "true", "yes")
+
+# Upstream resilience settings
+COUCHDB_TIMEOUT = float(os.getenv("COUCHDB_TIMEOUT", "300"))  # 5 minutes for large sync operations
+COUCHDB_CONNECT_TIMEOUT = float(os.getenv("COUCHDB_CONNECT_TIMEOUT", "5"))
+COUCHDB_MAX_CONNECTIONS = int(os.getenv("COUCHDB_MAX_CONNECTIONS", "100"))
+# Separate pool for long-polling _changes feeds (one connection per waiting device)
+LIVE_FEED_MAX_CONNECTIONS = int(os.getenv("LIVE_FEED_MAX_CONNECTIONS", "200"))
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+
+# Read replicas (comma-separated URLs) kept in sync from COUCHDB_URL by CouchDB replication
+COUCHDB_REPLICA_URLS = [u.strip() for u in os.getenv("COUCHDB_REPLICA_URLS", "").split(",") if u.strip()]
+READ_STICKY_SECONDS = float(os.getenv("READ_STICKY_SECONDS", "10"))
+READ_ROUTE_CHANGES = os.getenv("READ_ROUTE_CHANGES", "false").lower() in ("1", "true", "yes")
+
+# Retries of idempotent requests on connection failures, limited to
+# RETRY_BUDGET_RATIO extra requests per request. Bodies above
+# BODY_SPOOL_MEMORY bytes are spooled to a temp file for replay.
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.05"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "1.0"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+BODY_SPOOL_MEMORY = int(os.getenv("BODY_SPOOL_MEMORY", str(1024 * 1024)))
+BODY_SPOOL_DIR = os.getenv("BODY_SPOOL_DIR") or None
+
+# Hedged single-document and _local reads (opt-in): a duplicate goes out
+# once a read is slower than the HEDGE_PERCENTILE of recent ones, capped
+# at HEDGE_BUDGET_RATIO extra requests per eligible request
+HEDGE_READS = os.getenv("HEDGE_READS", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "5"))
+
+# Adaptive upstream concurrency limit (per worker process)
+UPSTREAM_LIMIT_INITIAL = int(os.getenv("UPSTREAM_LIMIT_INITIAL", "20"))
+UPSTREAM_LIMIT_MIN = int(os.getenv("UPSTREAM_LIMIT_MIN", "2"))
+UPSTREAM_LIMIT_MAX = int(os.getenv("UPSTREAM_LIMIT_MAX", "200"))
+# Event loop lag monitoring (seconds)
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "true").lower() in ("1", "true", "yes")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.05"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))
+
+# Per-request phase timing: Server-Timing response header (opt-in) and a
+# JSON-lines log of requests slower than the threshold (stderr if no file)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "2000"))
+SLOW_REQUEST_LOG = os.getenv("SLOW_REQUEST_LOG", "")
+
+# Traffic recorder (off unless a directory is set): per-request metadata and
+# sampled request bodies as rotating gzip NDJSON, replayable with
+# benchmarks/replay_traffic.py
+TRAFFIC_RECORD_DIR = os.getenv("TRAFFIC_RECORD_DIR", "")
+TRAFFIC_RECORD_BODY_RATE = float(os.getenv("TRAFFIC_RECORD_BODY_RATE", "0.01"))
+TRAFFIC_RECORD_BODY_LIMIT = int(os.getenv("TRAFFIC_RECORD_BODY_LIMIT", "4096"))
+TRAFFIC_RECORD_FILE_MB = int(os.getenv("TRAFFIC_RECORD_FILE_MB", "64"))
+TRAFFIC_RECORD_FILES = int(os.getenv("TRAFFIC_RECORD_FILES", "10"))
+
+# Per-class scheduling overrides, see admission.parse_class_config
+ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "")
+BULK_WRITE_THRESHOLD = int(os.getenv("BULK_WRITE_THRESHOLD", str(256 * 1024)))
+
+# Request body limits, enforced after auth and before the body is read
+# (see admission.BodyLimits). Defaults match COUCHDB_MAX_DOCUMENT_SIZE
+MAX_DOCUMENT_BODY = int(os.getenv("MAX_DOCUMENT_BODY", str(50 * 1024 * 1024)))
+MAX_REQUEST_BODY = int(os.getenv("MAX_REQUEST_BODY", str(50 * 1024 * 1024)))
+MAX_QUERY_BODY = int(os.getenv("MAX_QUERY_BODY", str(8 * 1024 * 1024)))
+
 # Database with configurable path
 db = TokenDatabase(db_path=TOKEN_DB_PATH)
 
+
+def make_upstream(url: str) -> CouchDBUpstream:
+    """Pooled CouchDB client with health probing and its own circuit breaker"""
+    return CouchDBUpstream(
+        url,
+        auth=(COUCHDB_USER, COUCHDB_PASSWORD),
+        timeout=COUCHDB_TIMEOUT,
+        connect_timeout=COUCHDB_CONNECT_TIMEOUT,
+        max_connections=COUCHDB_MAX_CONNECTIONS,
+        live_connections=LIVE_FEED_MAX_CONNECTIONS,
+        probe_interval=HEALTH_PROBE_INTERVAL,
+        breaker=CircuitBreaker(
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT
+        )
+    )
+
+
+# Primary takes all writes, safe reads are spread across primary and replicas
+upstreams = UpstreamPool(
+    make_upstream(COUCHDB_URL),
+    [make_upstream(url) for url in COUCHDB_REPLICA_URLS],
+    sticky_seconds=READ_STICKY_SECONDS,
+    route_changes=READ_ROUTE_CHANGES
+)
+
+# Bounds concurrent upstream calls, shrinking when CouchDB slows down,
+# and shares them between interactive, live, bulk and attachment traffic
+limiter = AdaptiveLimiter(
+    initial_limit=UPSTREAM_LIMIT_INITIAL,
+    min_limit=UPSTREAM_LIMIT_MIN,
+    max_limit=UPSTREAM_LIMIT_MAX,
+    classes=parse_class_config(ADMISSION_CLASSES)
+)
+
+pool_exhausted = metrics.counter(
+    "upstream_pool_exhausted_total", "Requests shed because no pooled CouchDB connection was free")
+
+body_limits = BodyLimits(document=MAX_DOCUMENT_BODY, request=MAX_REQUEST_BODY, query=MAX_QUERY_BODY)
+
+# Shared across requests so an outage can't multiply upstream load
+retry_budget = RetryBudget(ratio=RETRY_BUDGET_RATIO)
+hedging = HedgePolicy(
+    percentile=HEDGE_PERCENTILE,
+    budget_ratio=HEDGE_BUDGET_RATIO,
+    min_delay=HEDGE_MIN_DELAY_MS / 1000
+)
+
+# Keeps large admin payloads and PBKDF2 off the event loop
+executors = Executors(db_threads=DB_THREADS, cpu_processes=CPU_PROCESSES)
+
+# Read/write latency and sizes behind recommended sync tuning
+sync_stats = SyncStats()
+
+# Runtime diagnostics
+profiler = SamplingProfiler()
+loop_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL, stall_threshold=LOOP_STALL_THRESHOLD)
+slow_log = SlowRequestLog(SLOW_REQUEST_THRESHOLD_MS / 1000, SLOW_REQUEST_LOG or None)
+recorder = TrafficRecorder(
+    TRAFFIC_RECORD_DIR,
+    max_file_bytes=TRAFFIC_RECORD_FILE_MB * 1024 * 1024,
+    max_files=TRAFFIC_RECORD_FILES,
+    body_sample_rate=TRAFFIC_RECORD_BODY_RATE,
+    body_limit=TRAFFIC_RECORD_BODY_LIMIT
+) if TRAFFIC_RECORD_DIR else None
+
 # Security
 security = HTTPBearer()
 
 
-@app.on_event("startup")
+@api.on_event("startup")
 async def startup_event():
-    """Initialize database on startup"""
+    """Initialize database and upstream client on startup"""
     await db.init_db()
     print("✅ Token database initialized")
-
-
-@app.get("/health")
+    await upstreams.start()
+    for node in upstreams.nodes:
+        print(f"{'✅' if node.healthy else '⚠️ '} CouchDB upstream {node.url} "
+              f"({'up' if node.healthy else node.last_probe_error})")
+    if LOOP_MONITOR:
+        loop_monitor.start()
+    slow_log.start()
+    if recorder:
+        recorder.start()
+        print(f"⏺️  Recording traffic to {TRAFFIC_RECORD_DIR}")
+    if AUTH_OFFLOAD and not AUTH_VERIFY_SECRET:
+        print("⚠️  AUTH_MODE=offload without AUTH_VERIFY_SECRET - every auth_request will be refused")
+
+
+@api.on_event("shutdown")
+async def shutdown_event():
+    """Close upstream connections"""
+    await loop_monitor.stop()
+    await upstreams.stop()
+    slow_log.stop()
+    if recorder:
+        await recorder.stop()
+    executors.shutdown()
+
+
+@api.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "service": "obsidian-auth-proxy"}
+    """Health check endpoint, reflects the last CouchDB /_up probes"""
+    status = {
+        "status": "healthy" if upstreams.healthy else "unhealthy",
+        "service": "obsidian-auth-proxy",
+        "couchdb": upstreams.status(),
+    }
+    return JSONResponse(status, status_code=200 if upstreams.healthy else 503)
 
 
-async def extract_and_verify_token(authorization: Optional[str] = Header(None)) -> dict:
+async def extract_and_verify_token(
+    authorization: Optional[str] = Header(None),
+    timer: Optional[RequestTimer] = None
+) -> dict:
     """
     Extract and verify JWT token from either:
     1. Bearer token: Authorization: Bearer <jwt>
     2. Basic Auth with JWT as password: Authorization: Basic base64(username:jwt)
+
+    Phase durations (jwt, token_check, last_used) go to `timer` if given.
     """
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing authorization header")
@@ -77,7 +291,6 @@ async def extract_and_verify_token(authorization: Optional[str] = Header(None))
 
     # Try Basic authentication with JWT as password
     elif authorization.startswith("Basic "):
-        import base64
         try:
             # Decode Basic auth
             credentials = base64.b64decode(authorization.replace("Basic ", "")).decode('utf-8')
@@ -95,9 +308,12 @@ async def extract_and_verify_token(authorization: Optional[str] = Header(None))
     if not token:
         raise HTTPException(status_code=401, detail="No token found in authorization header")
 
+    started = time.perf_counter()
     try:
         # Decode JWT
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        if timer:
+            started = timer.since("jwt", started)
 
         # Extract token_id from JWT
         token_id = payload.get("token_id")
@@ -106,11 +322,15 @@ async def extract_and_verify_token(authorization: Optional[str] = Header(None))
 
         # Check if token is valid in database
         is_valid = await db.is_token_valid(token_id)
+        if timer:
+            started = timer.since("token_check", started)
         if not is_valid:
             raise HTTPException(status_code=401, detail="Token revoked or expired")
 
         # Update last used timestamp
         await db.update_last_used(token_id)
+        if timer:
+            timer.since("last_used", started)
 
         return payload
 
@@ -120,6 +340,17 @@ async def extract_and_verify_token(authorization: Optional[str] = Header(None))
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
 
 
+def authorize_path(payload: dict, path: str, encoded: bool = True):
+    """Refuse paths outside the token's allowed databases ("dbs" claim)"""
+    databases = payload.get("dbs")
+    if databases is None:
+        if REQUIRE_DB_SCOPE:
+            raise HTTPException(status_code=403, detail="Token is not scoped to any database")
+        return
+    if not path_allowed(tuple(databases), path, encoded):
+        raise HTTPException(status_code=403, detail="Token not authorized for this database")
+
+
 async def verify_admin_token(authorization: Optional[str] = Header(None)) -> bool:
     """Verify admin token for management API"""
     if not authorization:
@@ -138,17 +369,20 @@ async def verify_admin_token(authorization: Optional[str] = Header(None)) -> boo
 
 # ===== Management API (must be before catch-all) =====
 
-@app.post("/admin/tokens/create")
-async def create_token(
+async def issue_token(
     device_name: str,
     expires_in_days: Optional[int] = None,
     metadata: Optional[str] = None,
-    _admin: bool = Depends(verify_admin_token)
-):
-    """Create a new device token"""
+    databases: Optional[str] = None
+) -> dict:
+    """Store a new device token and sign its JWT"""
+    try:
+        allowed_databases = parse_databases(databases)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # Create token in database
-    token_data = await db.create_token(device_name, expires_in_days, metadata)
+    token_data = await db.create_token(device_name, expires_in_days, metadata, allowed_databases)
 
     # Generate JWT with the token_id
     jwt_payload = {
@@ -156,30 +390,119 @@ async def create_token(
         "device_name": device_name,
         "iat": datetime.utcnow(),
     }
+    if allowed_databases:
+        # Signed into the token so the proxy can authorize paths without a lookup
+        jwt_payload["dbs"] = allowed_databases
 
     if expires_in_days:
         jwt_payload["exp"] = datetime.utcnow() + timedelta(days=expires_in_days)
 
     jwt_token = jwt.encode(jwt_payload, JWT_SECRET, algorithm="HS256")
+    return {**token_data, "jwt_token": jwt_token}
 
+
+@api.post("/admin/tokens/create")
+async def create_token(
+    device_name: str,
+    expires_in_days: Optional[int] = None,
+    metadata: Optional[str] = None,
+    databases: Optional[str] = None,
+    _admin: bool = Depends(verify_admin_token)
+):
+    """Create a new device token, optionally limited to comma-separated databases"""
+    token = await issue_token(device_name, expires_in_days, metadata, databases)
     return {
-        **token_data,
-        "jwt_token": jwt_token,
-        "usage": f"Authorization: Bearer {jwt_token}"
+        **token,
+        "usage": f"Authorization: Bearer {token['jwt_token']}"
     }
 
 
-@app.get("/admin/tokens/list")
+@api.post("/admin/setup-uri")
+async def create_setup_uri(
+    device_name: str,
+    e2ee_passphrase: Optional[str] = None,
+    expires_in_days: Optional[int] = None,
+    databases: Optional[str] = None,
+    profile: str = "default",
+    base: str = "desktop",
+    _admin: bool = Depends(verify_admin_token)
+):
+    """
+    Create a device token and an encrypted LiveSync setup URI for it
+
+    The token is scoped to DB_NAME unless databases is given. profile picks
+    the sync tuning (see /admin/tuning); "recommend" sizes it from this
+    worker's observed traffic, starting from base. Key derivation (PBKDF2)
+    runs in the CPU process pool.
+    """
+    try:
+        if profile == "recommend":
+            tuning = sync_stats.recommend(base)["settings"]
+        else:
+            tuning = tuning_profile(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    couchdb_uri, couchdb_dbname = couchdb_location(PUBLIC_URL, DB_NAME)
+    token = await issue_token(device_name, expires_in_days, databases=databases or couchdb_dbname)
+    setup_uri, uri_passphrase, e2ee_pass = await executors.run_cpu(
+        generate_setup_uri,
+        couchdb_uri=couchdb_uri,
+        couchdb_user=SYNC_USER,
+        couchdb_password=token["jwt_token"],
+        couchdb_dbname=couchdb_dbname,
+        e2ee_passphrase=e2ee_passphrase,
+        device_name=device_name,
+        tuning=tuning
+    )
+    return {
+        "token_id": token["token_id"],
+        "device_name": device_name,
+        "allowed_databases": token["allowed_databases"],
+        "profile": profile,
+        "tuning": tuning,
+        "setup_uri": setup_uri,
+        "uri_passphrase": uri_passphrase,
+        "e2ee_passphrase": e2ee_pass,
+    }
+
+
+@api.get("/admin/tuning")
+async def get_tuning(
+    base: str = "desktop",
+    _admin: bool = Depends(verify_admin_token)
+):
+    """
+    Sync tuning profiles, and settings recommended from the read/write
+    latency and payload sizes this worker has observed
+    """
+    try:
+        recommended = sync_stats.recommend(base)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"profiles": TUNING_PROFILES, "recommended": recommended, "pid": os.getpid()}
+
+
+@api.get("/admin/tokens/list")
 async def list_tokens(
     include_revoked: bool = False,
     _admin: bool = Depends(verify_admin_token)
 ):
     """List all device tokens"""
-    tokens = await db.list_tokens(include_revoked=include_revoked)
-    return {"tokens": tokens, "count": len(tokens)}
+    body = await executors.run_db(render_token_list, include_revoked)
+    return Response(body, media_type="application/json")
+
 
+def render_token_list(include_revoked: bool) -> bytes:
+    """Query and serialize the token list in one executor hop (can be large)"""
+    tokens = db.list_tokens_sync(include_revoked=include_revoked)
+    # One dumps() per row: a single call over the whole list holds the GIL
+    # for its full duration and would stall the event loop thread anyway
+    rows = ",".join(json.dumps(token) for token in tokens)
+    return f'{{"tokens": [{rows}], "count": {len(tokens)}}}'.encode("utf-8")
 
-@app.post("/admin/tokens/revoke/{token_id}")
+
+@api.post("/admin/tokens/revoke/{token_id}")
 async def revoke_token(
     token_id: str,
     _admin: bool = Depends(verify_admin_token)
@@ -193,7 +516,7 @@ async def revoke_token(
     return {"message": f"Token {token_id} revoked successfully"}
 
 
-@app.delete("/admin/tokens/delete/{token_id}")
+@api.delete("/admin/tokens/delete/{token_id}")
 async def delete_token(
     token_id: str,
     _admin: bool = Depends(verify_admin_token)
@@ -207,7 +530,7 @@ async def delete_token(
     return {"message": f"Token {token_id} deleted permanently"}
 
 
-@app.get("/admin/tokens/info/{token_id}")
+@api.get("/admin/tokens/info/{token_id}")
 async def get_token_info(
     token_id: str,
     _admin: bool = Depends(verify_admin_token)
@@ -221,85 +544,487 @@ async def get_token_info(
     return token
 
 
-@app.post("/admin/tokens/cleanup")
+@api.post("/admin/tokens/cleanup")
 async def cleanup_expired_tokens(_admin: bool = Depends(verify_admin_token)):
     """Delete all expired tokens"""
     count = await db.cleanup_expired()
     return {"message": f"Deleted {count} expired tokens"}
 
 
-# ===== CouchDB Proxy (catch-all, must be LAST) =====
-
-@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "HEAD", "OPTIONS", "PATCH"])
-async def proxy_to_couchdb(request: Request, path: str):
-    """Proxy all requests to CouchDB after JWT validation"""
-
-    # Build CouchDB URL
-    couchdb_url = f"{COUCHDB_URL}/{path}"
-    if request.url.query:
-        couchdb_url += f"?{request.url.query}"
-
-    # Get request body
-    body = await request.body()
-
-    # Prepare headers (exclude auth headers and transfer-encoding, we'll add our own)
-    headers = dict(request.headers)
-    headers.pop("host", None)
-    headers.pop("transfer-encoding", None)  # Remove to avoid conflict with content-length
-
-    # For OPTIONS requests (CORS preflight), pass through directly to CouchDB
-    # Do NOT validate JWT for OPTIONS requests
-    if request.method == "OPTIONS":
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=request.method,
-                url=couchdb_url,
-                content=body,
-                headers=headers,
-                auth=(COUCHDB_USER, COUCHDB_PASSWORD),
-                timeout=300.0
-            )
+@api.get("/admin/metrics")
+async def get_metrics(
+    format: str = "json",
+    _admin: bool = Depends(verify_admin_token)
+):
+    """Proxy metrics for this worker (JSON, or format=prometheus)"""
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus())
+    return {
+        "metrics": metrics.to_dict(),
+        "limiter": limiter.snapshot(),
+        "hedging": {"enabled": HEDGE_READS, **hedging.snapshot()},
+        "pid": os.getpid(),
+    }
 
-        response_headers = dict(response.headers)
-        response_headers.pop("transfer-encoding", None)
 
-        return Response(
-            content=response.content,
-            status_code=response.status_code,
-            headers=response_headers,
-            media_type=response.headers.get("content-type")
-        )
+@api.get("/admin/debug/profile")
+async def profile_worker(
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    all_threads: bool = False,
+    format: str = "collapsed",
+    _admin: bool = Depends(verify_admin_token)
+):
+    """
+    Sample the stacks of the worker serving this request for `seconds`
 
-    # For all other requests, validate JWT
-    payload = await extract_and_verify_token(authorization=headers.get("authorization"))
-
-    # Remove authorization header before proxying to CouchDB
-    headers.pop("authorization", None)
-
-    # Make async request to CouchDB with Basic Auth
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            method=request.method,
-            url=couchdb_url,
-            content=body,
-            headers=headers,
-            auth=(COUCHDB_USER, COUCHDB_PASSWORD),
-            timeout=300.0  # 5 minutes for large sync operations
-        )
+    Returns collapsed stacks for flamegraph tools, or JSON with format=json.
+    With several uvicorn workers, each call profiles whichever one answers.
+    """
+    if seconds <= 0 or seconds > SamplingProfiler.MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {SamplingProfiler.MAX_SECONDS:.0f}]")
+    try:
+        stacks = await profiler.profile(seconds, max(interval_ms, 1.0) / 1000, all_threads)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "json":
+        return {
+            "pid": os.getpid(),
+            "samples": sum(stacks.values()),
+            "stacks": [{"stack": stack, "count": count} for stack, count in stacks.most_common()],
+        }
+    return PlainTextResponse(
+        SamplingProfiler.render_collapsed(stacks),
+        headers={"X-Worker-Pid": str(os.getpid())}
+    )
 
-    # Prepare response headers, removing transfer-encoding to avoid conflicts
-    response_headers = dict(response.headers)
-    response_headers.pop("transfer-encoding", None)
 
-    # Return CouchDB response
-    return Response(
-        content=response.content,
-        status_code=response.status_code,
-        headers=response_headers,
-        media_type=response.headers.get("content-type")
+@api.get("/admin/debug/loop")
+async def loop_lag(_admin: bool = Depends(verify_admin_token)):
+    """Event loop lag histogram and recent stall stacks for this worker"""
+    return {"pid": os.getpid(), "enabled": LOOP_MONITOR, **loop_monitor.snapshot()}
+
+
+# ===== CouchDB Proxy (raw ASGI fast path) =====
+
+# Hop-by-hop headers (RFC 7230 6.1) plus those the upstream client sets itself
+REQUEST_SKIP_HEADERS = {
+    b"host", b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"transfer-encoding", b"upgrade", b"content-length",
+    b"expect",  # answered here; the upstream request carries the whole body
+}
+RESPONSE_SKIP_HEADERS = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"transfer-encoding", b"upgrade",
+    b"date", b"server",  # set by uvicorn
+}
+
+
+async def send_json(
+    send,
+    status_code: int,
+    content: dict,
+    headers: Optional[dict] = None,
+    timer: Optional[RequestTimer] = None
+) -> int:
+    """Write a complete JSON response to an ASGI send channel; return the body size"""
+    body = json.dumps(content).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode("latin-1"), str(value).encode("latin-1")))
+    if timer and SERVER_TIMING:
+        raw_headers.append((b"server-timing", timer.server_timing()))
+    await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+    return len(body)
+
+
+def body_too_large(limit: int) -> HTTPException:
+    # Connection: close - the client may still be sending the rest of the body
+    return HTTPException(
+        status_code=413,
+        detail=f"Request body exceeds {limit} bytes",
+        headers={"Connection": "close"}
     )
 
 
+def admit_body(method: str, path: str, content_length: Optional[bytes]) -> int:
+    """
+    Body size limit for a request, raising 413 if its declared
+    Content-Length is already over it
+    """
+    limit = body_limits.limit(method, path)
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length")
+        if declared > limit:
+            body_limits.rejected.inc()
+            raise body_too_large(limit)
+    return limit
+
+
+async def read_body(receive, limit: Optional[int] = None) -> SpooledBody:
+    """
+    Read the full request body from an ASGI receive channel into a replayable spool
+
+    The first receive() is what makes uvicorn answer Expect: 100-continue.
+    Raises 413 as soon as more than `limit` bytes arrive.
+    """
+    body = SpooledBody(BODY_SPOOL_MEMORY, BODY_SPOOL_DIR)
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionResetError("Client disconnected")
+            chunk = message.get("body", b"")
+            if limit is not None and body.size + len(chunk) > limit:
+                body_limits.aborted.inc()
+                raise body_too_large(limit)
+            await body.write(chunk)
+            if not message.get("more_body", False):
+                return body
+    except BaseException:
+        body.close()
+        raise
+
+
+async def open_upstream(
+    method: str,
+    path: str,
+    query: str,
+    body: SpooledBody,
+    headers: list,
+    device: Optional[str] = None,
+    timer: Optional[RequestTimer] = None
+):
+    """
+    Route a request to a CouchDB node through the limiter and its circuit breaker
+
+    Returns (response, finish) with the response body still unread; finish()
+    must be called once the body has been relayed, to close the upstream
+    stream and return the limiter slot.
+    Idempotent requests are retried (on a freshly selected node) when the
+    connection fails before a response arrives, within the retry budget.
+    With HEDGE_READS, slow single-document and _local reads are raced
+    against a duplicate (see hedge.race).
+    Records queue, connect and upstream (time to response headers) phases.
+    """
+    target = f"{path}?{query}" if query else path
+    if body.on_disk:
+        # Streamed from the spool file; send the length rather than chunking
+        headers = headers + [(b"content-length", str(body.size).encode())]
+    max_attempts = 1 + UPSTREAM_RETRIES if is_retry_safe(method, path, query, headers) else 1
+    retry_budget.deposit()
+    hedge = hedge_kind(method, path) if HEDGE_READS else None
+    hedge_delay = hedging.delay(hedge) if hedge else None
+    queued = time.perf_counter()
+
+    # Long-polling feeds mostly idle on CouchDB, so they bypass the limiter
+    live_feed = is_live_feed(path, query)
+    traffic_class = classify_request(method, path, body.size, BULK_WRITE_THRESHOLD)
+    if not live_feed:
+        try:
+            await limiter.acquire(traffic_class)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=503,
+                detail=e.reason,
+                headers={"Retry-After": str(int(e.retry_after))}
+            )
+
+    if timer:
+        timer.since("queue", queued)
+    attempt = 1
+    try:
+        while True:
+            node = upstreams.select(method, path, device)
+            request = node.build_request(method, target, content=body.content(), headers=headers)
+            if timer:
+                request.extensions["trace"] = connect_tracer(timer)
+            started = time.monotonic()
+            try:
+                if hedge_delay is not None:
+                    response = await race(
+                        hedging,
+                        hedge,
+                        hedge_delay,
+                        lambda: node.send(request, stream=True),
+                        lambda: hedge_send(method, target, headers, device)
+                    )
+                else:
+                    response = await node.send(request, stream=True, record_latency=not live_feed, live=live_feed)
+                break
+            except RETRYABLE_ERRORS:
+                if attempt >= max_attempts or not retry_budget.try_spend():
+                    raise
+            delay = backoff_delay(attempt, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX)
+            if timer:
+                timer.add("retry", time.monotonic() - started + delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+    except CircuitOpenError as e:
+        if not live_feed:
+            limiter.release(traffic_class)
+        raise HTTPException(
+            status_code=503,
+            detail="CouchDB unavailable",
+            headers={"Retry-After": str(int(e.retry_after + 0.5))}
+        )
+    except httpx.PoolTimeout:
+        # Every pooled connection is busy: shed like an admission rejection, CouchDB is fine
+        pool_exhausted.inc()
+        if not live_feed:
+            limiter.release(traffic_class)
+        raise HTTPException(
+            status_code=503,
+            detail="Too many live feeds" if live_feed else "Upstream connection pool exhausted",
+            headers={"Retry-After": "1"}
+        )
+    except httpx.TimeoutException:
+        if not live_feed:
+            limiter.release(traffic_class, overloaded=True)
+        raise HTTPException(status_code=504, detail="CouchDB timed out")
+    except httpx.HTTPError as e:
+        if not live_feed:
+            limiter.release(traffic_class)
+        raise HTTPException(
+            status_code=502,
+            detail=f"CouchDB unreachable: {type(e).__name__}",
+            headers={"Retry-After": str(int(node.breaker.retry_after() + 0.5) or 1)}
+        )
+    except BaseException:
+        if not live_feed:
+            limiter.release(traffic_class)
+        raise
+
+    # Time to response headers - independent of payload size
+    latency = time.monotonic() - started
+    # A hedged race records its original attempt's own latency itself
+    if hedge and hedge_delay is None:
+        hedging.observe(hedge, latency)
+    if timer:
+        timer.add("upstream", max(0.0, latency - timer.phases.get("connect", 0.0)))
+    overloaded = response.status_code >= 500
+
+    if is_replicated_write(method, path):
+        upstreams.record_write(device)
+
+    async def finish():
+        try:
+            await response.aclose()
+        finally:
+            if not live_feed:
+                limiter.release(traffic_class, latency, overloaded)
+
+    return response, finish
+
+
+async def hedge_send(method: str, target: str, headers: list, device: Optional[str]) -> httpx.Response:
+    """Duplicate of a bodiless read, on whichever node is best now"""
+    path = target.split("?", 1)[0]
+    node = upstreams.select(method, path, device)
+    return await node.send(node.build_request(method, target, headers=headers), stream=True)
+
+
+async def relay_response(
+    response: httpx.Response,
+    send,
+    method: str,
+    state: dict,
+    timer: Optional[RequestTimer] = None
+):
+    """Stream the upstream response to the client chunk by chunk"""
+    headers = [
+        (name, value) for name, value in response.headers.raw
+        if name.lower() not in RESPONSE_SKIP_HEADERS
+    ]
+    if timer and SERVER_TIMING:
+        headers.append((b"server-timing", timer.server_timing()))
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+
+    started = time.perf_counter()
+    if method != "HEAD":
+        # Raw bytes: content-encoding and content-length pass through untouched
+        async for chunk in response.aiter_raw():
+            state["bytes_out"] += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    state["completed"] = True
+    await send({"type": "http.response.body", "body": b""})
+    if timer:
+        timer.since("transfer", started)
+
+
+async def watch_disconnect(receive, task: asyncio.Task, state: dict):
+    """Cancel the proxy task when the client goes away before the response is complete"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            if not state["completed"]:
+                state["disconnected"] = True
+                task.cancel()
+            return
+
+
+async def proxy_to_couchdb(scope, receive, send):
+    """Proxy a request to CouchDB after JWT validation (ASGI application)"""
+    timer = RequestTimer()
+    method = scope["method"]
+    path = scope.get("raw_path", b"").split(b"?", 1)[0].decode("latin-1") or quote(scope["path"])
+    path = path.lstrip("/")
+    query = scope["query_string"].decode("latin-1")
+
+    # Filter the raw header list without merging duplicates into a dict
+    started = time.perf_counter()
+    authorization = None
+    content_length = None
+    headers = []
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            content_length = value
+        if name in REQUEST_SKIP_HEADERS:
+            continue
+        if name == b"authorization":
+            authorization = value.decode("latin-1")
+            # OPTIONS keeps it; the upstream client replaces it with CouchDB Basic Auth
+            if method != "OPTIONS":
+                continue
+        headers.append((name, value))
+    timer.since("parse", started)
+
+    state = {"completed": False, "disconnected": False, "status": 0, "bytes_out": 0}
+    payload = {}
+    body = None
+    watcher = None
+    try:
+        try:
+            # For OPTIONS requests (CORS preflight), pass through directly to CouchDB
+            # Do NOT validate JWT for OPTIONS requests
+            device = None
+            if method != "OPTIONS":
+                payload = await extract_and_verify_token(authorization=authorization, timer=timer)
+                authorize_path(payload, path)
+                device = payload.get("token_id")
+
+            # Nothing has been received yet: rejected requests cost no body
+            # bytes, and clients waiting on 100-continue never send one
+            limit = admit_body(method, path, content_length)
+            started = time.perf_counter()
+            body = await read_body(receive, limit)
+            timer.since("body", started)
+
+            watcher = asyncio.create_task(watch_disconnect(receive, asyncio.current_task(), state))
+            response, finish = await open_upstream(method, path, query, body, headers, device, timer)
+        except HTTPException as e:
+            state["completed"] = True
+            state["status"] = e.status_code
+            state["bytes_out"] = await send_json(send, e.status_code, {"detail": e.detail}, e.headers, timer)
+            return
+        except ConnectionResetError:
+            state["disconnected"] = True
+            return
+
+        state["status"] = response.status_code
+        try:
+            await relay_response(response, send, method, state, timer)
+        finally:
+            await finish()
+    except asyncio.CancelledError:
+        if not state["disconnected"]:
+            raise
+    finally:
+        state["completed"] = True
+        if watcher:
+            watcher.cancel()
+        bytes_in = body.size if body is not None else 0
+        entry = {
+            "method": method,
+            "endpoint": endpoint_label(path),
+            "path": path,
+            "device": payload.get("device_name"),
+            "status": state["status"],
+            "bytes_in": bytes_in,
+            "bytes_out": state["bytes_out"],
+            "disconnected": state["disconnected"],
+        }
+        sync_stats.observe(method, entry["endpoint"], state["status"], timer.total(), bytes_in, state["bytes_out"])
+        if recorder:
+            head = body.head(TRAFFIC_RECORD_BODY_LIMIT) if body is not None else None
+            recorder.record(entry, query, timer.total(), head, bytes_in)
+        if body is not None:
+            body.close()
+        slow_log.record(timer, entry)
+
+
+# ===== nginx auth_request offload =====
+
+async def verify_auth(scope, receive, send):
+    """
+    auth_request target: 204 when the device may make the original request,
+    or the same 401/403 the proxy would have returned
+
+    nginx injects the CouchDB credentials itself, so nothing secret is
+    returned and decisions are safe to cache. CORS preflights are answered
+    by nginx and never get here.
+    """
+    authorization = None
+    original_uri = ""
+    secret = b""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            authorization = value.decode("latin-1")
+        elif name == b"x-original-uri":
+            original_uri = value.decode("latin-1")
+        elif name == b"x-auth-verify-secret":
+            secret = value
+
+    # Only nginx's internal subrequest knows the secret; to anyone else this path does not exist
+    if not AUTH_VERIFY_SECRET or not hmac.compare_digest(secret, AUTH_VERIFY_SECRET.encode("utf-8")):
+        await send_json(send, 404, {"detail": "Not found"})
+        return
+
+    try:
+        payload = await extract_and_verify_token(authorization=authorization)
+        # nginx decodes the URI before its rewrite, so CouchDB sees the decoded path
+        path = unquote(original_uri.split("?", 1)[0])
+        if path.startswith(AUTH_OFFLOAD_PREFIX):
+            path = path[len(AUTH_OFFLOAD_PREFIX):]
+        else:
+            path = "_unknown"
+        authorize_path(payload, path, encoded=False)
+    except HTTPException as e:
+        await send_json(send, e.status_code, {"detail": e.detail}, e.headers)
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 204,
+        "headers": [(b"x-auth-device", quote(payload.get("device_name", "")).encode("latin-1"))],
+    })
+    await send({"type": "http.response.body", "body": b""})
+
+
+# API paths served by FastAPI; everything else is CouchDB traffic
+API_PATHS = ("/health",)
+API_PREFIXES = ("/admin/",)
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: CouchDB requests skip FastAPI routing entirely"""
+    if scope["type"] == "http":
+        path = scope["path"]
+        if AUTH_OFFLOAD and path == AUTH_VERIFY_PATH:
+            await verify_auth(scope, receive, send)
+            return
+        if path not in API_PATHS and not path.startswith(API_PREFIXES):
+            await proxy_to_couchdb(scope, receive, send)
+            return
+    # Lifespan events and API requests
+    await api(scope, receive, send)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,113 @@
+"""
+In-process metrics registry for the auth proxy
+Values are per worker process; rendered as JSON or Prometheus text
+"""
+import bisect
+from typing import Callable, Dict, Optional, Sequence
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def get(self) -> float:
+        return self.fn() if self.fn else self.value
+
+
+class Histogram:
+    """Fixed-bucket histogram (upper bounds, Prometheus style)"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"buckets": buckets, "sum": round(self.sum, 6), "count": self.count}
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "authproxy_"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        """Get or create a counter"""
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, help)
+        return self._metrics[name]
+
+    def gauge(self, name: str, help: str = "", fn: Optional[Callable[[], float]] = None) -> Gauge:
+        """Get or create a gauge, optionally computed by fn at read time"""
+        if name not in self._metrics:
+            self._metrics[name] = Gauge(name, help, fn)
+        elif fn is not None:
+            self._metrics[name].fn = fn
+        return self._metrics[name]
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = ()) -> Histogram:
+        """Get or create a histogram"""
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, help, buckets)
+        return self._metrics[name]
+
+    def to_dict(self) -> dict:
+        result = {}
+        for name, metric in sorted(self._metrics.items()):
+            if isinstance(metric, Histogram):
+                result[name] = metric.to_dict()
+            else:
+                result[name] = metric.get() if isinstance(metric, Gauge) else metric.value
+        return result
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            full_name = self.prefix + name
+            if metric.help:
+                lines.append(f"# HELP {full_name} {metric.help}")
+            if isinstance(metric, Histogram):
+                lines.append(f"# TYPE {full_name} histogram")
+                for bound, count in metric.to_dict()["buckets"].items():
+                    lines.append(f'{full_name}_bucket{{le="{bound}"}} {count}')
+                lines.append(f"{full_name}_sum {metric.sum}")
+                lines.append(f"{full_name}_count {metric.count}")
+                continue
+            kind = "gauge" if isinstance(metric, Gauge) else "counter"
+            value = metric.get() if isinstance(metric, Gauge) else metric.value
+            lines.append(f"# TYPE {full_name} {kind}")
+            lines.append(f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
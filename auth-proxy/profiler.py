@@ -0,0 +1,183 @@
+"""
+Runtime diagnostics for a live worker
+On-demand sampling profiler with collapsed-stack output, and an event-loop
+lag monitor that records lag histograms and logs the loop's stack on stalls
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter, deque
+from typing import Optional
+
+from metrics import metrics
+
+logger = logging.getLogger("auth_proxy.profiler")
+
+# Event-loop lag buckets in seconds
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse(frame) -> str:
+    """Root-first 'a;b;c' stack of a frame"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling Python stacks from a background thread
+
+    Sampling reads sys._current_frames() every interval, so overhead is
+    bounded by the sample rate regardless of how busy the worker is.
+    Output is Brendan Gregg's collapsed format ("frame;frame;frame count"),
+    ready for flamegraph.pl, speedscope or inferno.
+    """
+
+    MAX_SECONDS = 120.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def _acquire(self):
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running in this worker")
+
+    def sample(self, seconds: float, interval: float = 0.005, thread_id: Optional[int] = None) -> StackCounter:
+        """Sample for `seconds` (blocking); thread_id=None samples every thread"""
+        self._acquire()
+        return self._sample_locked(seconds, interval, thread_id)
+
+    def _sample_locked(self, seconds: float, interval: float, thread_id: Optional[int]) -> StackCounter:
+        try:
+            return self._sample(seconds, interval, thread_id)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, thread_id: Optional[int]) -> StackCounter:
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = StackCounter()
+        deadline = time.monotonic() + min(seconds, self.MAX_SECONDS)
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_id or (thread_id is not None and ident != thread_id):
+                    continue
+                thread_name = names.get(ident) or f"thread-{ident}"
+                stacks[f"{thread_name};{collapse(frame)}"] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def profile(self, seconds: float, interval: float = 0.005, all_threads: bool = False) -> StackCounter:
+        """Profile this worker without blocking its event loop"""
+        loop_thread = None if all_threads else threading.get_ident()
+        # Taken on the loop, so a concurrent call fails here rather than in the
+        # thread; the thread releases it, even if this request is cancelled
+        self._acquire()
+        return await asyncio.to_thread(self._sample_locked, seconds, interval, loop_thread)
+
+    @staticmethod
+    def render_collapsed(stacks: StackCounter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes a periodic timer
+
+    A coroutine sleeps `interval` and records the overshoot into a histogram.
+    A watchdog thread watches the coroutine's heartbeat; when the loop has
+    been stuck longer than `stall_threshold` it captures the loop thread's
+    stack while the stall is still happening and logs it.
+    """
+
+    def __init__(self, interval: float = 0.05, stall_threshold: float = 0.25, keep_stalls: int = 20):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.stalls: deque = deque(maxlen=keep_stalls)
+
+        self.lag = metrics.histogram("event_loop_lag_seconds", "Event loop timer overshoot", LAG_BUCKETS)
+        self.max_lag = metrics.gauge("event_loop_lag_max_seconds", "Largest event loop lag since start")
+        self._stall_count = metrics.counter("event_loop_stalls_total", "Event loop stalls over the threshold")
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._heartbeat = now
+            self.lag.observe(lag)
+            if lag > self.max_lag.value:
+                self.max_lag.set(lag)
+
+    def _watch(self):
+        reported_for = None
+        while not self._stopping.wait(self.stall_threshold / 2):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if stalled_for < self.stall_threshold or reported_for == heartbeat:
+                continue
+
+            # One report per stall, taken while the loop is still blocked
+            reported_for = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            self._stall_count.inc()
+            self.stalls.append({
+                "at": time.time(),
+                "stalled_for_ms": round(stalled_for * 1000, 1),
+                "stack": stack,
+            })
+            logger.warning(
+                "Event loop blocked for %.0f ms (pid %d), loop thread stack:\n%s",
+                stalled_for * 1000, os.getpid(), stack
+            )
+
+    def snapshot(self) -> dict:
+        return {
+            "interval_ms": self.interval * 1000,
+            "stall_threshold_ms": self.stall_threshold * 1000,
+            "max_lag_ms": round(self.max_lag.value * 1000, 1),
+            "lag": self.lag.to_dict(),
+            "recent_stalls": list(self.stalls),
+        }
@@ -0,0 +1,172 @@
+"""
+Opt-in traffic recorder for capturing real LiveSync sessions
+Request metadata (and sampled, truncated bodies) go to an in-memory ring
+buffer that a background task flushes to rotating gzip NDJSON files
+"""
+import asyncio
+import base64
+import glob
+import gzip
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import unquote_plus
+
+from metrics import metrics
+
+
+# JWTs (device tokens) anywhere in recorded text
+JWT_PATTERN = re.compile(rb"eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*")
+# Query parameters that must never be written out, matched by exact name -
+# CouchDB's own key, keys, startkey and endkey must survive for replay
+SECRET_PARAMS = frozenset({
+    "password", "passwd", "pass", "pwd",
+    "token", "access_token", "refresh_token", "id_token", "jwt",
+    "auth", "authorization", "secret", "client_secret", "api_key", "apikey",
+})
+
+
+def scrub_text(data: bytes) -> bytes:
+    return JWT_PATTERN.sub(b"<jwt>", data)
+
+
+def scrub_query(query: str) -> str:
+    if not query:
+        return query
+    params = []
+    for param in query.split("&"):
+        name, sep, _ = param.partition("=")
+        if unquote_plus(name).lower() in SECRET_PARAMS:
+            param = f"{name}{sep}<redacted>"
+        params.append(param)
+    return scrub_text("&".join(params).encode("latin-1")).decode("latin-1")
+
+
+class TrafficRecorder:
+    """
+    Records one line per proxied request
+
+    record() only builds a dict and appends it to a bounded deque, so the
+    request path never waits on disk; when the buffer is full the oldest
+    unflushed records are dropped (and counted). A background task drains
+    the buffer every flush_interval and writes it from a worker thread to
+    traffic-<start>-<pid>-<n>.ndjson.gz, rotating at max_file_bytes and
+    keeping at most max_files files per worker.
+
+    Request bodies are kept for a body_sample_rate fraction of requests,
+    truncated to body_limit bytes, with JWTs scrubbed. Headers are never
+    recorded, so Authorization values can't leak.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_file_bytes: int = 64 * 1024 * 1024,
+        max_files: int = 10,
+        buffer_size: int = 10000,
+        body_sample_rate: float = 0.01,
+        body_limit: int = 4096,
+        flush_interval: float = 1.0
+    ):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.body_sample_rate = body_sample_rate
+        self.body_limit = body_limit
+        self.flush_interval = flush_interval
+
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.started = time.monotonic()
+        self._prefix = f"traffic-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._file_index = 0
+        self._raw = None
+        self._gzip = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.recorded = metrics.counter("recorder_records_total", "Requests written by the traffic recorder")
+        self.dropped = metrics.counter("recorder_dropped_total", "Records dropped because the buffer was full")
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._gzip:
+            await asyncio.to_thread(self._close_file)
+
+    def record(
+        self,
+        entry: dict,
+        query: str,
+        duration: float,
+        body: Optional[bytes] = None,
+        body_size: int = 0
+    ):
+        """Queue one request; `entry` is copied, `body` is sampled and truncated here"""
+        record = dict(entry)
+        record["query"] = scrub_query(query)
+        record["t"] = round(time.monotonic() - self.started, 4)
+        record["ts"] = time.time()
+        record["duration_ms"] = round(duration * 1000, 2)
+
+        if body and random.random() < self.body_sample_rate:
+            head = scrub_text(body[:self.body_limit])
+            try:
+                record["body"] = head.decode("utf-8")
+            except UnicodeDecodeError:
+                record["body_b64"] = base64.b64encode(head).decode("ascii")
+            record["body_truncated"] = body_size > self.body_limit
+
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped.inc()
+        self.buffer.append(record)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        records = list(self.buffer)
+        self.buffer.clear()
+        await asyncio.to_thread(self._write, records)
+        self.recorded.inc(len(records))
+
+    def _write(self, records: list):
+        data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode("utf-8")
+        if self._gzip is None or self._raw.tell() >= self.max_file_bytes:
+            self._rotate()
+        self._gzip.write(data)
+        # Sync flush so a file is readable up to the last batch while still open
+        self._gzip.flush()
+
+    def _rotate(self):
+        self._close_file()
+        self._file_index += 1
+        path = os.path.join(self.directory, f"{self._prefix}-{self._file_index:04d}.ndjson.gz")
+        self._raw = open(path, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=5)
+
+        files = sorted(glob.glob(os.path.join(self.directory, f"traffic-*-{os.getpid()}-*.ndjson.gz")))
+        for old in files[:-self.max_files]:
+            os.remove(old)
+
+    def _close_file(self):
+        if self._gzip:
+            self._gzip.close()
+            self._raw.close()
+            self._gzip = self._raw = None
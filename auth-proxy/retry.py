@@ -0,0 +1,180 @@
+"""
+Safe retries for upstream CouchDB calls
+Idempotency rules, jittered backoff, a token-bucket retry budget and
+request bodies spooled to memory or disk so they can be replayed
+"""
+import asyncio
+import random
+import tempfile
+import time
+from typing import AsyncIterator, Optional, Union
+
+import httpx
+
+from metrics import metrics
+
+
+# Failures where CouchDB never produced a response: refused or reset
+# connections (restarts) and pooled keep-alive connections closed under us.
+# Read timeouts are not retried - the node is slow, not gone.
+RETRYABLE_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.RemoteProtocolError,
+    httpx.ReadError,
+    httpx.WriteError,
+)
+
+# POST endpoints that only read, so replaying them is harmless
+IDEMPOTENT_POST = {"_revs_diff", "_bulk_get"}
+
+
+def is_retry_safe(method: str, path: str, query: str = "", headers: Optional[list] = None) -> bool:
+    """
+    Whether a request may be sent twice without changing the outcome
+
+    GET/HEAD/OPTIONS, _revs_diff and _bulk_get, and PUTs that name the
+    revision they replace (?rev= or If-Match) - a replayed PUT that already
+    landed fails with 409 instead of writing a second revision.
+    """
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return True
+    parts = path.strip("/").split("/")
+    if method == "POST":
+        return len(parts) == 2 and parts[1] in IDEMPOTENT_POST
+    if method == "PUT":
+        if any(param.startswith("rev=") for param in query.split("&")):
+            return True
+        return any(name == b"if-match" for name, _ in headers or ())
+    return False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff for retry number `attempt` (1-based)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of request volume
+
+    Every request deposits `ratio` tokens and every retry spends one, plus a
+    small time-based allowance so a quiet proxy can still retry. During a
+    full outage retries therefore add at most `ratio` extra load instead of
+    multiplying it.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, capacity: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self._refilled_at = time.monotonic()
+
+        self.retries = metrics.counter("upstream_retries_total", "Upstream requests retried")
+        self.exhausted = metrics.counter("upstream_retry_budget_exhausted_total", "Retries skipped for lack of budget")
+        metrics.gauge("upstream_retry_budget", "Retry tokens available", lambda: int(self.tokens))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.tokens < 1.0:
+            self.exhausted.inc()
+            return False
+        self.tokens -= 1.0
+        self.retries.inc()
+        return True
+
+    def snapshot(self) -> dict:
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 1),
+            "ratio": self.ratio,
+            "retries": self.retries.value,
+            "exhausted": self.exhausted.value,
+        }
+
+
+class SpooledBody:
+    """
+    A request body that can be sent more than once
+
+    Bodies up to max_memory stay in memory; larger ones roll over to an
+    anonymous temp file. File I/O runs in a worker thread so big uploads
+    don't block the event loop.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, max_memory: int = 1024 * 1024, spool_dir: Optional[str] = None):
+        self.max_memory = max_memory
+        self.spool_dir = spool_dir
+        self.size = 0
+        self._chunks = []
+        self._file = None
+
+    @property
+    def on_disk(self) -> bool:
+        return self._file is not None
+
+    async def write(self, data: bytes):
+        if not data:
+            return
+        self.size += len(data)
+        if self._file is None:
+            self._chunks.append(data)
+            if self.size > self.max_memory:
+                await asyncio.to_thread(self._rollover)
+        else:
+            await asyncio.to_thread(self._file.write, data)
+
+    def _rollover(self):
+        self._file = tempfile.TemporaryFile(dir=self.spool_dir)
+        self._file.writelines(self._chunks)
+        self._chunks = []
+
+    def _read_at(self, offset: int) -> bytes:
+        self._file.seek(offset)
+        return self._file.read(self.CHUNK_SIZE)
+
+    async def _stream(self) -> AsyncIterator[bytes]:
+        offset = 0
+        while True:
+            chunk = await asyncio.to_thread(self._read_at, offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+    def content(self) -> Union[bytes, AsyncIterator[bytes]]:
+        """Request content for one attempt: bytes, or a fresh stream from the spool file"""
+        if self._file is None:
+            if len(self._chunks) != 1:
+                self._chunks = [b"".join(self._chunks)]
+            return self._chunks[0]
+        return self._stream()
+
+    def head(self, limit: int) -> Optional[bytes]:
+        """First `limit` bytes of an in-memory body (None once spooled to disk)"""
+        if self._file is not None:
+            return None
+        head = []
+        for chunk in self._chunks:
+            head.append(chunk[:limit])
+            limit -= len(head[-1])
+            if limit <= 0:
+                break
+        return b"".join(head)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunks = []
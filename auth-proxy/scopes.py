@@ -0,0 +1,79 @@
+"""
+Per-token database scoping
+Tokens may carry a set of CouchDB databases ("dbs" JWT claim); requests
+outside that set are refused before they reach CouchDB
+"""
+import functools
+import re
+from typing import Iterable, List, Optional
+from urllib.parse import unquote
+
+
+# CouchDB database names, optionally ending in * to allow a prefix ("alice/*")
+DATABASE_PATTERN = re.compile(r"^[a-z][a-z0-9_$()+/-]*\*?$")
+
+# Server-level endpoints a scoped token may still call - none expose other databases
+SCOPED_SERVER_PATHS = frozenset({"", "_up", "_session", "_uuids"})
+
+
+def parse_databases(spec: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """
+    Normalize a list (or comma-separated string) of database patterns
+
+    Returns None for "no restriction"; raises ValueError on invalid names.
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        spec = spec.split(",")
+    databases = []
+    for name in spec:
+        name = name.strip()
+        if not name:
+            continue
+        if not DATABASE_PATTERN.match(name):
+            raise ValueError(f"Invalid database name: {name}")
+        if name not in databases:
+            databases.append(name)
+    return databases or None
+
+
+class DatabaseScope:
+    """Compiled allowed-databases set: exact names hashed, prefixes as a tuple"""
+
+    __slots__ = ("exact", "prefixes")
+
+    def __init__(self, patterns: Iterable[str]):
+        self.exact = frozenset(p for p in patterns if not p.endswith("*"))
+        self.prefixes = tuple(p[:-1] for p in patterns if p.endswith("*"))
+
+    def allows(self, database: str) -> bool:
+        return database in self.exact or (bool(self.prefixes) and database.startswith(self.prefixes))
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_scope(patterns: tuple) -> DatabaseScope:
+    """Compiled scope for a token's claim, built once per distinct claim"""
+    return DatabaseScope(patterns)
+
+
+def path_database(path: str, encoded: bool = True) -> str:
+    """
+    Database a CouchDB request path addresses, as CouchDB will see it
+
+    The first path segment, percent-decoded once when `encoded` (a database
+    named "team/notes" arrives as team%2Fnotes).
+    """
+    segment = path.lstrip("/").split("/", 1)[0]
+    return unquote(segment) if encoded else segment
+
+
+def path_allowed(patterns: tuple, path: str, encoded: bool = True) -> bool:
+    """Whether a token scoped to `patterns` may request `path`"""
+    path = path.lstrip("/")
+    database = path_database(path, encoded)
+    if database.startswith("_") or not database:
+        return database in SCOPED_SERVER_PATHS and "/" not in path.rstrip("/")
+    if ".." in path.split("/"):
+        return False
+    return compile_scope(patterns).allows(database)
@@ -14,6 +14,8 @@ import os
 import sys
 from datetime import datetime, timezone
 
+from tuning import TUNING_PROFILES, tuning_profile
+
 def generate_passphrase(length=8):
     """Generate a friendly random passphrase"""
     words = []
@@ -74,11 +76,15 @@ def generate_setup_uri(
     uri_passphrase: str = None,
     use_encryption: bool = True,
     use_path_obfuscation: bool = True,
-    device_name: str = "Device"
+    device_name: str = "Device",
+    tuning: dict = None
 ) -> tuple[str, str]:
     """
     Generate Obsidian LiveSync setup URI
 
+    tuning overrides the sync throughput settings (see tuning.TUNING_PROFILES);
+    anything it leaves out comes from the "default" profile.
+
     Returns:
         tuple: (setup_uri, uri_passphrase)
     """
@@ -90,6 +96,9 @@ def generate_setup_uri(
     if e2ee_passphrase is None and use_encryption:
         e2ee_passphrase = generate_passphrase(6)
 
+    sync_settings = tuning_profile("default")
+    sync_settings.update(tuning or {})
+
     # Build configuration object (matches Obsidian LiveSync structure)
     config = {
         "couchDB_URI": couchdb_uri,
@@ -118,8 +127,8 @@ def generate_setup_uri(
         "autoSweepPluginsPeriodic": False,
         "notifyPluginOrSettingUpdated": False,
         "checkIntegrityOnSave": False,
-        "batch_size": 50,
-        "batches_limit": 50,
+        "batch_size": sync_settings["batch_size"],
+        "batches_limit": sync_settings["batches_limit"],
         "useHistory": False,
         "disableRequestURI": True,
         "skipOlderFilesOnSync": True,
@@ -134,7 +143,7 @@ def generate_setup_uri(
         "deleteMetadataOfDeletedFiles": False,
         "syncIgnoreRegEx": "",
         "syncOnlyRegEx": "",
-        "customChunkSize": 0,
+        "customChunkSize": sync_settings["customChunkSize"],
         "readChunksOnline": True,
         "watchInternalFileChanges": True,
         "trashInsteadDelete": True,
@@ -149,10 +158,10 @@ def generate_setup_uri(
         "useTimeoutAPI": False,
         "writeLogToTheFile": False,
         "doNotPaceReplication": False,
-        "hashCacheMaxCount": 300,
+        "hashCacheMaxCount": sync_settings["hashCacheMaxCount"],
         "hashCacheMaxAmount": 50,
-        "concurrencyOfReadChunksOnline": 30,
-        "minimumIntervalOfReadChunksOnline": 333,
+        "concurrencyOfReadChunksOnline": sync_settings["concurrencyOfReadChunksOnline"],
+        "minimumIntervalOfReadChunksOnline": sync_settings["minimumIntervalOfReadChunksOnline"],
         "hashAlg": "xxhash64",
     }
 
@@ -177,21 +186,81 @@ def generate_setup_uri(
 
     return setup_uri, uri_passphrase, e2ee_passphrase
 
+def couchdb_location(public_url: str, db_name: str) -> tuple[str, str]:
+    """
+    (couchDB_URI, couchDB_DBNAME) for a vault behind nginx's /obsidian path
+
+    LiveSync requests {couchDB_URI}/{couchDB_DBNAME}/...; nginx strips
+    /obsidian/, so CouchDB (and token scopes) see the database as db_name.
+    """
+    public_url = public_url.rstrip("/")
+    couchdb_uri = f"{public_url}/obsidian" if not public_url.endswith("/obsidian") else public_url
+    return couchdb_uri, db_name
+
+def recommended_tuning(base: str) -> dict:
+    """Ask the running proxy for settings sized from the traffic it has seen"""
+    import httpx
+
+    host = os.getenv("AUTH_PROXY_HOST", "127.0.0.1")
+    port = os.getenv("AUTH_PROXY_PORT", "5985")
+    api_base = os.getenv("API_BASE", f"http://{host}:{port}/admin")
+    response = httpx.get(
+        f"{api_base}/tuning",
+        params={"base": base},
+        headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
+        timeout=10.0,
+    )
+    response.raise_for_status()
+    return response.json()["recommended"]
+
 def main():
-    if len(sys.argv) < 2:
+    # --db NAME (repeatable), --unscoped, --profile NAME and --base NAME may appear anywhere
+    args = []
+    databases = []
+    unscoped = False
+    profile = "default"
+    base = "desktop"
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        if arg == "--db":
+            databases.append(next(argv, ""))
+        elif arg == "--unscoped":
+            unscoped = True
+        elif arg == "--profile":
+            profile = next(argv, "")
+        elif arg == "--base":
+            base = next(argv, "")
+        else:
+            args.append(arg)
+
+    if not args:
         print("""
-Usage: setup_uri.py <device-name> [e2ee-passphrase]
+Usage: setup_uri.py <device-name> [e2ee-passphrase] [--db NAME]... [--unscoped]
+                    [--profile NAME] [--base NAME]
 
 Examples:
     setup_uri.py "iPhone"                    # Auto-generate E2EE passphrase
     setup_uri.py "Laptop" "my-vault-secret"  # Use specific E2EE passphrase
+    setup_uri.py "Tablet" --db alice-notes   # Token limited to the alice-notes database
+    setup_uri.py "Pixel" --profile mobile    # Sync settings for phones on cellular
+    setup_uri.py "Mac" --profile recommend --base desktop
 
 This will create a JWT token for the device and generate a setup URI.
-        """)
+The token may only reach DB_NAME (or the --db databases) unless --unscoped is given.
+
+Profiles set batch sizes, chunk fetching and hash cache size:
+    %s
+recommend asks the running proxy to size them from observed latency and
+payloads, starting from --base (default desktop).
+        """ % ", ".join(TUNING_PROFILES))
+        sys.exit(1)
+
+    if (profile != "recommend" and profile not in TUNING_PROFILES) or base not in TUNING_PROFILES:
+        print(f"❌ Unknown profile; choose from {', '.join(TUNING_PROFILES)} or recommend")
         sys.exit(1)
 
-    device_name = sys.argv[1]
-    e2ee_passphrase = sys.argv[2] if len(sys.argv) > 2 else None
+    device_name = args[0]
+    e2ee_passphrase = args[1] if len(args) > 1 else None
 
     # Import the database module to create token
     from database import TokenDatabase
@@ -205,11 +274,41 @@ This will create a JWT token for the device and generate a setup URI.
         if os.path.exists(ENV_FILE):
             load_dotenv(ENV_FILE)
 
+        from scopes import parse_databases
+
+        # Get configuration from environment
+        PUBLIC_URL = os.getenv("PUBLIC_URL", "https://obsidian.example.com")
+        SYNC_USER = os.getenv("SYNC_USER", "obsidian")
+        DB_NAME = os.getenv("DB_NAME", "obsidian-sync")
+
+        if profile == "recommend":
+            try:
+                recommendation = recommended_tuning(base)
+            except Exception as e:
+                print(f"❌ Could not get a recommendation from the proxy: {e}")
+                sys.exit(1)
+            tuning = recommendation["settings"]
+            for note in recommendation["notes"]:
+                print(f"ℹ️  {note}")
+        else:
+            tuning = tuning_profile(profile)
+
+        # Build CouchDB URL path
+        # For nginx with /obsidian path: PUBLIC_URL/obsidian + DB_NAME
+        couchdb_uri, couchdb_dbname = couchdb_location(PUBLIC_URL, DB_NAME)
+
+        # Scope the token to the vault database it is being set up for
+        try:
+            allowed_databases = None if unscoped else parse_databases(databases or [couchdb_dbname])
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
         # Create JWT token for device
         db = TokenDatabase()
         await db.init_db()
 
-        token_data = await db.create_token(device_name, expires_in_days=None)
+        token_data = await db.create_token(device_name, expires_in_days=None, allowed_databases=allowed_databases)
 
         # Generate JWT
         import jwt
@@ -217,21 +316,13 @@ This will create a JWT token for the device and generate a setup URI.
 
         JWT_SECRET = os.getenv("JWT_HMAC_SECRET")
 
-        # Get configuration from environment
-        PUBLIC_URL = os.getenv("PUBLIC_URL", "https://obsidian.example.com")
-        SYNC_USER = os.getenv("SYNC_USER", "obsidian")
-        DB_NAME = os.getenv("DB_NAME", "obsidian-sync")
-
-        # Build CouchDB URL path
-        # For nginx with /obsidian path: PUBLIC_URL/DB_NAME
-        couchdb_uri = f"{PUBLIC_URL}/obsidian" if not PUBLIC_URL.endswith("/obsidian") else PUBLIC_URL
-        couchdb_dbname = f"obsidian/{DB_NAME}"
-
         jwt_payload = {
             "token_id": token_data["token_id"],
             "device_name": device_name,
             "iat": datetime.now(timezone.utc),
         }
+        if allowed_databases:
+            jwt_payload["dbs"] = allowed_databases
         jwt_token = jwt.encode(jwt_payload, JWT_SECRET, algorithm="HS256")
 
         # Generate setup URI
@@ -241,7 +332,8 @@ This will create a JWT token for the device and generate a setup URI.
             couchdb_password=jwt_token,  # JWT token as password (Basic Auth)
             couchdb_dbname=couchdb_dbname,
             e2ee_passphrase=e2ee_passphrase,
-            device_name=device_name
+            device_name=device_name,
+            tuning=tuning
         )
 
         print("\n" + "="*80)
@@ -251,6 +343,9 @@ This will create a JWT token for the device and generate a setup URI.
         print(f"🔑 Token ID: {token_data['token_id']}")
         print(f"📅 Created: {token_data['created_at']}")
         print(f"⏰ Expires: Never")
+        print(f"🗄️  Databases: {', '.join(allowed_databases) if allowed_databases else 'all'}")
+        print(f"⚙️  Sync profile: {profile}" + (f" (from {base})" if profile == "recommend" else ""))
+        print("   " + ", ".join(f"{name}={value}" for name, value in tuning.items()))
 
         print(f"\n🔐 End-to-End Encryption Passphrase:")
         print(f"   {e2ee_pass}")
@@ -0,0 +1,124 @@
+"""
+Chunk GC must not delete chunks whose file document has not arrived yet
+"""
+import json
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENV_FILE", "/nonexistent")
+
+import chunk_gc  # noqa: E402
+
+
+class FakeCouchDB:
+    """One database behind httpx.MockTransport: info, _changes (selector), _bulk_docs"""
+
+    def __init__(self):
+        self.docs = {}
+        self.seq = 0
+
+    def put(self, doc: dict):
+        self.seq += 1
+        generation = int(self.docs[doc["_id"]]["_rev"].split("-")[0]) + 1 if doc["_id"] in self.docs else 1
+        self.docs[doc["_id"]] = dict(doc, _rev=f"{generation}-{self.seq}", _seq=self.seq)
+
+    def live(self, doc_id: str) -> bool:
+        return doc_id in self.docs and not self.docs[doc_id].get("_deleted")
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "GET" and path == "/db":
+            return httpx.Response(200, json={"doc_count": len(self.docs)})
+        if path == "/db/_changes":
+            return self.changes(request)
+        if path == "/db/_bulk_docs":
+            rows = []
+            for doc in json.loads(request.content)["docs"]:
+                if self.docs.get(doc["_id"], {}).get("_rev") == doc["_rev"]:
+                    self.put(doc)
+                    rows.append({"ok": True, "id": doc["_id"]})
+                else:
+                    rows.append({"error": "conflict", "id": doc["_id"]})
+            return httpx.Response(201, json=rows)
+        return httpx.Response(404, json={"error": "not_found"})
+
+    def changes(self, request: httpx.Request) -> httpx.Response:
+        selector = json.loads(request.content)["selector"] if request.method == "POST" else {}
+        since = int(request.url.params.get("since", "0"))
+        include_docs = request.url.params.get("include_docs") == "true"
+        lines = []
+        for doc in sorted(self.docs.values(), key=lambda d: d["_seq"]):
+            if doc["_seq"] <= since or not self.matches(selector, doc):
+                continue
+            row = {"seq": doc["_seq"], "id": doc["_id"], "changes": [{"rev": doc["_rev"]}]}
+            if doc.get("_deleted"):
+                row["deleted"] = True
+            if include_docs:
+                row["doc"] = {k: v for k, v in doc.items() if k != "_seq"}
+            lines.append(json.dumps(row))
+        lines.append(json.dumps({"last_seq": self.seq}))
+        return httpx.Response(200, content="\n".join(lines) + "\n")
+
+    @staticmethod
+    def matches(selector: dict, doc: dict) -> bool:
+        for key, value in selector.items():
+            if isinstance(value, dict):
+                if (key in doc) != value["$exists"]:
+                    return False
+            elif doc.get(key) != value:
+                return False
+        return True
+
+
+def run_gc(monkeypatch, couch: FakeCouchDB, state: str, *args: str):
+    client = httpx.Client(base_url="http://couchdb", transport=httpx.MockTransport(couch.handle))
+    monkeypatch.setattr(chunk_gc, "couchdb_client", lambda url=None: client)
+    monkeypatch.setattr(sys, "argv", ["chunk_gc.py", "--db", "db", "--state", state, "--apply", *args])
+    chunk_gc.main()
+
+
+def test_chunk_uploaded_before_its_file_doc_survives(monkeypatch, tmp_path):
+    couch = FakeCouchDB()
+    couch.put({"_id": "h:kept", "type": "leaf", "data": "a"})
+    couch.put({"_id": "note-1", "type": "plain", "children": ["h:kept"]})
+    couch.put({"_id": "h:stale", "type": "leaf", "data": "b"})
+    # First batch of a sync: the chunk is uploaded, its note is still on the device
+    couch.put({"_id": "h:early", "type": "leaf", "data": "c"})
+    state = str(tmp_path / "state.ndjson")
+
+    # First run only records candidates
+    run_gc(monkeypatch, couch, state)
+    assert all(couch.live(doc_id) for doc_id in ("h:kept", "h:stale", "h:early"))
+
+    # Still within the grace period: nothing is deleted, and the older state is kept
+    with open(state) as f:
+        created = json.loads(f.readline())["created"]
+    run_gc(monkeypatch, couch, state)
+    assert all(couch.live(doc_id) for doc_id in ("h:kept", "h:stale", "h:early"))
+    with open(state) as f:
+        assert json.loads(f.readline())["created"] == created
+
+    # The note arrives in a later batch (or after an interrupted sync resumes)
+    couch.put({"_id": "note-2", "type": "plain", "children": ["h:early"]})
+
+    run_gc(monkeypatch, couch, state, "--grace-hours", "0")
+    assert couch.live("h:kept")
+    assert couch.live("h:early")
+    assert not couch.live("h:stale")
+
+
+def test_reuploaded_chunk_starts_a_new_grace_period(monkeypatch, tmp_path):
+    couch = FakeCouchDB()
+    couch.put({"_id": "h:chunk", "type": "leaf", "data": "a"})
+    state = str(tmp_path / "state.ndjson")
+
+    run_gc(monkeypatch, couch, state)
+    # Deleted elsewhere and uploaded again by a device: a new revision
+    couch.put({"_id": "h:chunk", "type": "leaf", "data": "a"})
+
+    run_gc(monkeypatch, couch, state, "--grace-hours", "0")
+    assert couch.live("h:chunk")
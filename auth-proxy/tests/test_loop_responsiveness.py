@@ -0,0 +1,35 @@
+"""
+Admin work on a large token table must not stall sync traffic in the same worker
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+os.environ.setdefault("ENV_FILE", "/nonexistent")
+os.environ.setdefault("JWT_HMAC_SECRET", "test-secret-test-secret-test-secret-test")
+os.environ.setdefault("COUCHDB_PASSWORD", "test")
+os.environ.setdefault("TOKEN_DB_PATH", os.path.join(tempfile.mkdtemp(), "tokens.db"))
+os.environ.setdefault("LOOP_MONITOR", "false")
+
+import main  # noqa: E402
+from loop_responsiveness import measure, percentile  # noqa: E402
+
+# Running the same admin work inline on the event loop gives seconds of lag
+# and sync latency; with the executors both stay around a tenth of these.
+MAX_LAG_P99 = 0.1
+MAX_SYNC_P99 = 0.5
+
+
+def test_admin_load_keeps_loop_responsive(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "test-admin")
+    result = asyncio.run(measure(tokens=20000, duration=3.0))
+
+    assert result["admin_ops"]["list"] > 0
+    assert result["admin_ops"]["setup_uri"] > 0
+    assert result["sync"], "no sync requests completed"
+    assert percentile(result["lag"], 0.99) < MAX_LAG_P99
+    assert percentile(result["sync"], 0.99) < MAX_SYNC_P99
@@ -0,0 +1,69 @@
+"""
+Setup URIs must point devices at the database their token is scoped to
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENV_FILE", "/nonexistent")
+os.environ.setdefault("JWT_HMAC_SECRET", "test-secret-test-secret-test-secret-test")
+os.environ.setdefault("COUCHDB_PASSWORD", "test")
+os.environ.setdefault("TOKEN_DB_PATH", os.path.join(tempfile.mkdtemp(), "tokens.db"))
+os.environ.setdefault("LOOP_MONITOR", "false")
+
+import main  # noqa: E402
+from scopes import path_allowed  # noqa: E402
+from setup_uri import derive_key  # noqa: E402
+
+# nginx's location for CouchDB traffic; it strips this before proxying
+NGINX_PREFIX = "/obsidian/"
+
+
+def decrypt_setup_uri(setup_uri: str, uri_passphrase: str) -> dict:
+    """Inverse of setup_uri.encrypt_config"""
+    encrypted = setup_uri.split("settings=", 1)[1]
+    iv, salt, ciphertext = bytes.fromhex(encrypted[1:33]), bytes.fromhex(encrypted[33:65]), encrypted[65:]
+    iterations = len(uri_passphrase) * 1000 + 121 - len(uri_passphrase)
+    key = derive_key(uri_passphrase, salt, iterations)
+    return json.loads(AESGCM(key).decrypt(iv[:12], base64.b64decode(ciphertext), None))
+
+
+def proxied_path(config: dict, rest: str) -> str:
+    """Path the auth proxy sees for a LiveSync request to {URI}/{DBNAME}/{rest}"""
+    url = f"{config['couchDB_URI'].rstrip('/')}/{config['couchDB_DBNAME']}/{rest}"
+    path = urlsplit(url).path
+    assert path.startswith(NGINX_PREFIX)
+    return path[len(NGINX_PREFIX):]
+
+
+@pytest.mark.parametrize("public_url", [
+    "https://obsidian.example.com",
+    "https://obsidian.example.com/",
+    "https://obsidian.example.com/obsidian",
+])
+def test_default_scope_allows_setup_uri_database(monkeypatch, public_url):
+    monkeypatch.setattr(main, "PUBLIC_URL", public_url)
+
+    async def create():
+        await main.db.init_db()
+        return await main.create_setup_uri(device_name="phone", _admin=True)
+
+    result = asyncio.run(create())
+    config = decrypt_setup_uri(result["setup_uri"], result["uri_passphrase"])
+    claims = jwt.decode(config["couchDB_PASSWORD"], main.JWT_SECRET, algorithms=["HS256"])
+    scope = tuple(claims["dbs"])
+
+    assert scope == (main.DB_NAME,)
+    for rest in ("", "_changes", "_local/checkpoint", "h:abc123", "_bulk_docs"):
+        assert path_allowed(scope, proxied_path(config, rest)), rest
+    assert not path_allowed(scope, "other-vault/_changes")
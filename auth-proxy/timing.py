@@ -0,0 +1,111 @@
+"""
+Per-request phase timing for the proxy path
+Server-Timing header rendering and a non-blocking JSON slow-request log
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Optional
+
+
+class RequestTimer:
+    """Collects named phase durations for one request"""
+
+    __slots__ = ("started", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def since(self, name: str, started: float) -> float:
+        """Record the phase from `started` until now; return now"""
+        now = time.perf_counter()
+        self.add(name, now - started)
+        return now
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> bytes:
+        """Server-Timing header value (durations in milliseconds)"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.total() * 1000:.2f}")
+        return ", ".join(parts).encode("ascii")
+
+    def phases_ms(self) -> dict:
+        return {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()}
+
+
+def connect_tracer(timer: RequestTimer):
+    """httpcore trace hook recording TCP/TLS connect time (zero for pooled connections)"""
+    marks = {}
+
+    async def trace(event_name: str, info: dict):
+        if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            marks[event_name[:-8]] = time.perf_counter()
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            started = marks.get(event_name[:-9])
+            if started is not None:
+                timer.add("connect", time.perf_counter() - started)
+
+    return trace
+
+
+def endpoint_label(path: str) -> str:
+    """Coarse CouchDB endpoint name for a request path, without document ids"""
+    parts = path.strip("/").split("/")
+    if not parts[0]:
+        return "/"
+    if parts[0].startswith("_"):
+        return parts[0]
+    if len(parts) == 1:
+        return "db"
+    if parts[1].startswith("_"):
+        return parts[1]
+    return "doc" if len(parts) == 2 else "attachment"
+
+
+class SlowRequestLog:
+    """
+    JSON-lines log of requests slower than a threshold
+
+    Entries are handed to a queue and written by a background thread
+    (QueueHandler/QueueListener), so a slow disk never blocks the event loop.
+    """
+
+    def __init__(self, threshold: float, path: Optional[str] = None):
+        self.threshold = threshold
+        self.logger = logging.getLogger("auth_proxy.slow_requests")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+        if path:
+            target = logging.handlers.WatchedFileHandler(path)
+        else:
+            target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(logging.Formatter("%(message)s"))
+
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self.listener = logging.handlers.QueueListener(log_queue, target)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+    def record(self, timer: RequestTimer, entry: dict):
+        total = timer.total()
+        if total < self.threshold:
+            return
+        entry["ts"] = time.time()
+        entry["total_ms"] = round(total * 1000, 2)
+        entry["phases_ms"] = timer.phases_ms()
+        self.logger.info(json.dumps(entry, separators=(",", ":")))
@@ -0,0 +1,205 @@
+"""
+LiveSync sync tuning profiles for setup URIs
+Named per-device-class settings, and recommendations derived from the
+latency and payload sizes this proxy has observed
+"""
+from typing import Dict, Optional
+
+from metrics import Histogram, metrics
+
+# The throughput-critical LiveSync settings a setup URI carries:
+#   batch_size / batches_limit - docs per replication batch / batches buffered
+#   concurrencyOfReadChunksOnline - chunks fetched per on-demand request
+#   minimumIntervalOfReadChunksOnline - ms between on-demand chunk fetches
+#   customChunkSize - chunk size multiplier (0 = plugin default)
+#   hashCacheMaxCount - chunk hashes cached in memory on the device
+TUNING_PROFILES: Dict[str, dict] = {
+    # What every setup URI used before profiles existed
+    "default": {
+        "batch_size": 50,
+        "batches_limit": 50,
+        "concurrencyOfReadChunksOnline": 30,
+        "minimumIntervalOfReadChunksOnline": 333,
+        "customChunkSize": 0,
+        "hashCacheMaxCount": 300,
+    },
+    # Cellular, limited memory: small batches, paced fetches
+    "mobile": {
+        "batch_size": 25,
+        "batches_limit": 20,
+        "concurrencyOfReadChunksOnline": 15,
+        "minimumIntervalOfReadChunksOnline": 500,
+        "customChunkSize": 0,
+        "hashCacheMaxCount": 150,
+    },
+    "desktop": {
+        "batch_size": 100,
+        "batches_limit": 50,
+        "concurrencyOfReadChunksOnline": 40,
+        "minimumIntervalOfReadChunksOnline": 150,
+        "customChunkSize": 0,
+        "hashCacheMaxCount": 1000,
+    },
+    # Same network as the server: round trips are cheap, go wide
+    "lan": {
+        "batch_size": 200,
+        "batches_limit": 100,
+        "concurrencyOfReadChunksOnline": 80,
+        "minimumIntervalOfReadChunksOnline": 25,
+        "customChunkSize": 1,
+        "hashCacheMaxCount": 2000,
+    },
+    # First full sync of a large vault on a good connection; set the device
+    # up again with a regular profile once it has caught up
+    "initial-bulk": {
+        "batch_size": 250,
+        "batches_limit": 150,
+        "concurrencyOfReadChunksOnline": 100,
+        "minimumIntervalOfReadChunksOnline": 10,
+        "customChunkSize": 1,
+        "hashCacheMaxCount": 5000,
+    },
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Endpoints LiveSync reads chunks and documents through, and writes with
+READ_ENDPOINTS = {"doc", "_all_docs", "_bulk_get"}
+WRITE_ENDPOINTS = {"_bulk_docs"}
+
+# Below this many samples a class keeps the base profile's values
+MIN_SAMPLES = 50
+# Latency the default chunk fetch settings were sized for
+REFERENCE_LATENCY = 0.1
+# A replication batch should take about this long to upload
+TARGET_BATCH_SECONDS = 1.0
+# Docs a device buffers across batches_limit batches
+BATCH_BUFFER_BYTES = 64 * 1024 * 1024
+
+
+def tuning_profile(name: str) -> dict:
+    """Settings of a named profile (ValueError for unknown names)"""
+    try:
+        return dict(TUNING_PROFILES[name])
+    except KeyError:
+        raise ValueError(f"Unknown tuning profile {name!r} (choose from {', '.join(TUNING_PROFILES)})")
+
+
+def histogram_quantile(histogram: Histogram, q: float) -> Optional[float]:
+    """Estimate a quantile by linear interpolation within fixed buckets"""
+    if not histogram.count:
+        return None
+    rank = q * histogram.count
+    lower = 0.0
+    seen = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        if count and seen + count >= rank:
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    # In the +Inf bucket: the last finite bound is all we know
+    return histogram.buckets[-1]
+
+
+def clamp(value: float, low: int, high: int) -> int:
+    return int(max(low, min(high, round(value))))
+
+
+class SyncStats:
+    """
+    Latency and payload size histograms for LiveSync read and write traffic
+
+    Only successful responses count. Values are per worker and cover the
+    worker's lifetime; they are exported with the other metrics.
+    """
+
+    def __init__(self):
+        self.read_latency = metrics.histogram(
+            "sync_read_latency_seconds", "Document and chunk read latency", LATENCY_BUCKETS)
+        self.read_bytes = metrics.histogram(
+            "sync_read_response_bytes", "Document and chunk read response size", SIZE_BUCKETS)
+        self.doc_bytes = metrics.histogram(
+            "sync_doc_response_bytes", "Single document or chunk GET response size", SIZE_BUCKETS)
+        self.write_latency = metrics.histogram(
+            "sync_write_latency_seconds", "_bulk_docs latency", LATENCY_BUCKETS)
+        self.write_bytes = metrics.histogram(
+            "sync_write_request_bytes", "_bulk_docs request size", SIZE_BUCKETS)
+
+    def observe(self, method: str, endpoint: str, status: int, seconds: float, bytes_in: int, bytes_out: int):
+        if not 200 <= status < 300:
+            return
+        if endpoint in READ_ENDPOINTS and method in ("GET", "POST"):
+            self.read_latency.observe(seconds)
+            self.read_bytes.observe(bytes_out)
+            if endpoint == "doc":
+                self.doc_bytes.observe(bytes_out)
+        elif endpoint in WRITE_ENDPOINTS and method == "POST":
+            self.write_latency.observe(seconds)
+            self.write_bytes.observe(bytes_in)
+
+    def snapshot(self) -> dict:
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        def mean(histogram):
+            return round(histogram.sum / histogram.count) if histogram.count else None
+
+        return {
+            "read_requests": self.read_latency.count,
+            "read_p50_ms": ms(histogram_quantile(self.read_latency, 0.5)),
+            "read_p90_ms": ms(histogram_quantile(self.read_latency, 0.9)),
+            "read_mean_bytes": mean(self.read_bytes),
+            "doc_requests": self.doc_bytes.count,
+            "doc_mean_bytes": mean(self.doc_bytes),
+            "write_requests": self.write_latency.count,
+            "write_p90_ms": ms(histogram_quantile(self.write_latency, 0.9)),
+            "write_bytes_per_second": (
+                round(self.write_bytes.sum / self.write_latency.sum) if self.write_latency.sum else None
+            ),
+        }
+
+    def recommend(self, base: str = "desktop") -> dict:
+        """
+        Start from a base profile and replace the network-sensitive values
+        with ones sized from observed traffic
+
+        - Chunk fetches: more chunks per request as round trips get slower
+          (scaled from the default's 30 at 100 ms), fewer if responses are
+          already large; no new fetch sooner than a p90 fetch takes.
+        - Replication batches: sized so one uploads in about a second at the
+          observed _bulk_docs throughput. batches_limit keeps the buffered
+          docs within BATCH_BUFFER_BYTES and never exceeds the base's.
+        - Slow round trips (p50 >= 250 ms) also double the chunk size.
+
+        hashCacheMaxCount depends on device memory and stays at the base's.
+        Returns {"base", "settings", "stats", "notes"}.
+        """
+        settings = tuning_profile(base)
+        stats = self.snapshot()
+        notes = []
+
+        if self.read_latency.count >= MIN_SAMPLES:
+            p50 = histogram_quantile(self.read_latency, 0.5)
+            p90 = histogram_quantile(self.read_latency, 0.9)
+            chunks = 30 * p50 / REFERENCE_LATENCY
+            mean_bytes = self.read_bytes.sum / self.read_bytes.count
+            if mean_bytes > 2 * 1024 * 1024:
+                chunks *= 2 * 1024 * 1024 / mean_bytes
+            settings["concurrencyOfReadChunksOnline"] = clamp(chunks, 10, 100)
+            settings["minimumIntervalOfReadChunksOnline"] = clamp(p90 * 1000, 10, 1000)
+            if p50 >= 0.25:
+                settings["customChunkSize"] = max(settings["customChunkSize"], 1)
+        else:
+            notes.append(f"fewer than {MIN_SAMPLES} reads observed; chunk fetch settings from {base}")
+
+        doc_bytes = self.doc_bytes.sum / self.doc_bytes.count if self.doc_bytes.count >= MIN_SAMPLES else None
+        if self.write_latency.count >= MIN_SAMPLES and doc_bytes:
+            rate = self.write_bytes.sum / self.write_latency.sum
+            batch_size = clamp(rate * TARGET_BATCH_SECONDS / doc_bytes / 5, 2, 50) * 5
+            settings["batch_size"] = batch_size
+            settings["batches_limit"] = clamp(BATCH_BUFFER_BYTES / (batch_size * doc_bytes), 10, settings["batches_limit"])
+        else:
+            notes.append(f"fewer than {MIN_SAMPLES} writes or document reads observed; batch settings from {base}")
+
+        return {"base": base, "settings": settings, "stats": stats, "notes": notes}
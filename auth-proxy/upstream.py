@@ -0,0 +1,446 @@
+"""
+Upstream CouchDB connection management
+Shared HTTP client, active health probing of /_up, a circuit breaker and
+latency-aware read routing across a primary and its read replicas
+"""
+import asyncio
+import random
+import time
+from typing import Optional, List
+
+import httpx
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker rejects a request without calling CouchDB"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker
+
+    CLOSED    - requests flow, consecutive failures (of requests and health
+                probes alike) are counted
+    OPEN      - requests fail fast until reset_timeout elapses
+                (or the health probe sees CouchDB come back)
+    HALF_OPEN - a limited number of trial requests go through;
+                enough successes close the circuit, any failure re-opens it
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+        half_open_max_calls: int = 2,
+        success_threshold: int = 2
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.half_open_successes = 0
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a trial request through"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_request(self):
+        """Admit a request or raise CircuitOpenError"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(max(1.0, self.retry_after()))
+            self._half_open()
+
+        if self.state == self.HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                raise CircuitOpenError(1.0)
+            self.half_open_calls += 1
+
+    def record_success(self):
+        """Record a successful upstream call"""
+        if self.state == self.HALF_OPEN:
+            self.half_open_calls = max(0, self.half_open_calls - 1)
+            self.half_open_successes += 1
+            if self.half_open_successes >= self.success_threshold:
+                self._close()
+        else:
+            self.failures = 0
+
+    def record_failure(self):
+        """Record a failed upstream call (transport error, timeout or 5xx)"""
+        if self.state == self.HALF_OPEN:
+            self.trip()
+            return
+
+        self.failures += 1
+        if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self):
+        """Force the breaker open"""
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.half_open_calls = 0
+        self.half_open_successes = 0
+
+    def probe_succeeded(self):
+        """Health probe saw CouchDB up - skip the rest of the open period"""
+        if self.state == self.OPEN:
+            self._half_open()
+
+    def _half_open(self):
+        self.state = self.HALF_OPEN
+        self.half_open_calls = 0
+        self.half_open_successes = 0
+
+    def _close(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.half_open_calls = 0
+        self.half_open_successes = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+        }
+
+
+class CouchDBUpstream:
+    """
+    A single CouchDB node: pooled client, breaker and background /_up probe
+
+    Long-polling _changes feeds hold a connection each for up to their
+    timeout, so they get a separate pool of live_connections; a crowd of
+    idle devices can then never take the connections other requests need.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        auth: tuple,
+        timeout: float = 300.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        live_connections: int = 200,
+        probe_interval: float = 5.0,
+        probe_interval_unhealthy: float = 1.0,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.url = url.rstrip("/")
+        self.auth = auth
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout, pool=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        )
+        self.live_limits = httpx.Limits(
+            max_connections=live_connections,
+            max_keepalive_connections=live_connections
+        )
+        self.probe_interval = probe_interval
+        self.probe_interval_unhealthy = probe_interval_unhealthy
+        self.breaker = breaker or CircuitBreaker()
+
+        self.client: Optional[httpx.AsyncClient] = None
+        self.live_client: Optional[httpx.AsyncClient] = None
+        self.ewma_latency: Optional[float] = None
+        self.inflight = 0
+        self.ejected_until = 0.0
+        self.healthy = False
+        self.last_probe_at: Optional[float] = None
+        self.last_probe_error: Optional[str] = None
+        self._probe_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Open the connection pool, run a first probe and start probing"""
+        self.client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout, limits=self.limits)
+        self.live_client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout, limits=self.live_limits)
+        await self.probe()
+        self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self._probe_task:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+        if self.live_client:
+            await self.live_client.aclose()
+            self.live_client = None
+
+    async def probe(self) -> bool:
+        """Probe GET /_up once and update health and breaker state"""
+        try:
+            response = await self.client.get(
+                f"{self.url}/_up",
+                timeout=self.timeout.connect
+            )
+            self.healthy = response.status_code == 200
+            self.last_probe_error = None if self.healthy else f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            self.healthy = False
+            self.last_probe_error = f"{type(e).__name__}: {e}"
+
+        self.last_probe_at = time.time()
+        if self.healthy:
+            self.breaker.probe_succeeded()
+        else:
+            # Counts toward failure_threshold like a failed request: a sustained
+            # outage trips the breaker without client traffic, one slow probe does not
+            self.breaker.record_failure()
+        return self.healthy
+
+    async def _probe_loop(self):
+        while True:
+            interval = self.probe_interval if self.healthy else self.probe_interval_unhealthy
+            await asyncio.sleep(interval)
+            await self.probe()
+
+    async def send(
+        self,
+        request: httpx.Request,
+        stream: bool = False,
+        record_latency: bool = True,
+        live: bool = False
+    ) -> httpx.Response:
+        """
+        Send a request through the breaker
+
+        Long-polling feeds should pass live=True (their own pool) and
+        record_latency=False so their deliberate waits don't look like a
+        slow node.
+        Raises CircuitOpenError when failing fast, httpx.PoolTimeout when no
+        pooled connection freed up in time (not counted against the node),
+        httpx.HTTPError on transport failure
+        """
+        self.breaker.before_request()
+        self.inflight += 1
+        started = time.monotonic()
+        client = self.live_client if live and self.live_client else self.client
+        try:
+            response = await client.send(request, stream=stream)
+        except httpx.PoolTimeout:
+            # Our own pool is full - says nothing about CouchDB's health
+            if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                self.breaker.half_open_calls = max(0, self.breaker.half_open_calls - 1)
+            raise
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled or otherwise aborted - release a half-open slot without judging
+            if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                self.breaker.half_open_calls = max(0, self.breaker.half_open_calls - 1)
+            raise
+        finally:
+            self.inflight -= 1
+
+        if record_latency:
+            self.record_latency(time.monotonic() - started)
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def record_latency(self, seconds: float, alpha: float = 0.3):
+        """Fold a response time into the exponentially weighted moving average"""
+        if self.ewma_latency is None:
+            self.ewma_latency = seconds
+        else:
+            self.ewma_latency += alpha * (seconds - self.ewma_latency)
+
+    @property
+    def available(self) -> bool:
+        return (
+            self.healthy
+            and self.breaker.state != CircuitBreaker.OPEN
+            and self.ejected_until <= time.monotonic()
+        )
+
+    def build_request(self, method: str, path: str, **kwargs) -> httpx.Request:
+        return self.client.build_request(method, f"{self.url}/{path}", **kwargs)
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "last_probe_at": self.last_probe_at,
+            "last_probe_error": self.last_probe_error,
+            "ewma_latency_ms": None if self.ewma_latency is None else round(self.ewma_latency * 1000, 1),
+            "inflight": self.inflight,
+            "ejected": self.ejected_until > time.monotonic(),
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+# Database-level endpoints that are safe to answer from a replica.
+# _local documents (replication checkpoints) are never replicated, and
+# _changes sequences differ between nodes, so neither may leave the primary.
+REPLICA_SAFE_POST = {"_bulk_get"}
+PRIMARY_ONLY = {"_local", "_revs_diff", "_bulk_docs", "_purge", "_compact", "_ensure_full_commit"}
+
+
+def is_live_feed(path: str, query: str) -> bool:
+    """Whether a request is a _changes feed that holds the connection open"""
+    if not path.rstrip("/").endswith("/_changes"):
+        return False
+    return any(
+        param in ("feed=longpoll", "feed=continuous", "feed=eventsource")
+        for param in query.split("&")
+    )
+
+
+def is_replica_readable(method: str, path: str, route_changes: bool = False) -> bool:
+    """Whether a request is a safe read that a replica may serve"""
+    parts = path.strip("/").split("/")
+    # Server-level endpoints and database info stay on the primary
+    if len(parts) < 2 or parts[0].startswith("_"):
+        return False
+
+    endpoint = parts[1]
+    if endpoint in PRIMARY_ONLY:
+        return False
+    if endpoint == "_changes":
+        return route_changes and method in ("GET", "HEAD")
+
+    if method in ("GET", "HEAD"):
+        return True
+    return method == "POST" and endpoint in REPLICA_SAFE_POST
+
+
+def is_replicated_write(method: str, path: str) -> bool:
+    """
+    Whether a request changes documents that replicas will receive
+    (_bulk_docs, document and attachment writes). Checkpoints in _local and
+    read-only POSTs such as _revs_diff, _all_docs or _find do not count.
+    """
+    parts = path.strip("/").split("/")
+    if not parts[0] or parts[0].startswith("_"):
+        return False
+    if len(parts) == 1:
+        return method == "POST"
+    endpoint = parts[1]
+    if endpoint == "_bulk_docs":
+        return method == "POST"
+    if endpoint.startswith("_") and endpoint != "_design":
+        return False
+    return method in ("PUT", "DELETE", "COPY")
+
+
+class UpstreamPool:
+    """
+    A write primary plus read replicas kept in sync by CouchDB replication
+
+    Safe reads go to the available node with the lowest EWMA latency
+    (weighted by requests in flight, picked from two random candidates).
+    Nodes much slower than the fastest one are ejected for a cooldown.
+    A device that just wrote reads from the primary for sticky_seconds
+    so it always sees its own writes.
+    """
+
+    def __init__(
+        self,
+        primary: CouchDBUpstream,
+        replicas: Optional[List[CouchDBUpstream]] = None,
+        sticky_seconds: float = 10.0,
+        route_changes: bool = False,
+        outlier_factor: float = 3.0,
+        outlier_min_latency: float = 0.05,
+        eject_seconds: float = 30.0
+    ):
+        self.primary = primary
+        self.replicas = replicas or []
+        self.sticky_seconds = sticky_seconds
+        self.route_changes = route_changes
+        self.outlier_factor = outlier_factor
+        self.outlier_min_latency = outlier_min_latency
+        self.eject_seconds = eject_seconds
+        self._sticky_until: dict = {}
+
+    @property
+    def nodes(self) -> List[CouchDBUpstream]:
+        return [self.primary] + self.replicas
+
+    @property
+    def healthy(self) -> bool:
+        """Writes need the primary, so it alone decides overall health"""
+        return self.primary.healthy
+
+    async def start(self):
+        await asyncio.gather(*(node.start() for node in self.nodes))
+
+    async def stop(self):
+        await asyncio.gather(*(node.stop() for node in self.nodes))
+
+    def record_write(self, device: Optional[str]):
+        """Pin a device's reads to the primary after it wrote"""
+        if not device or not self.replicas:
+            return
+        now = time.monotonic()
+        self._sticky_until[device] = now + self.sticky_seconds
+        if len(self._sticky_until) > 10000:
+            self._sticky_until = {d: t for d, t in self._sticky_until.items() if t > now}
+
+    def select(self, method: str, path: str, device: Optional[str] = None) -> CouchDBUpstream:
+        """Pick the node to send a request to"""
+        if not self.replicas or not is_replica_readable(method, path, self.route_changes):
+            return self.primary
+        if device and self._sticky_until.get(device, 0.0) > time.monotonic():
+            return self.primary
+
+        self._eject_outliers()
+        candidates = [node for node in self.nodes if node.available]
+        if not candidates:
+            return self.primary
+        if len(candidates) == 1:
+            return candidates[0]
+        return min(random.sample(candidates, 2), key=self._score)
+
+    @staticmethod
+    def _score(node: CouchDBUpstream) -> float:
+        # Unmeasured nodes score zero so they get sampled early
+        return (node.ewma_latency or 0.0) * (node.inflight + 1)
+
+    def _eject_outliers(self):
+        now = time.monotonic()
+        measured = [n for n in self.nodes if n.ewma_latency is not None and n.ejected_until <= now]
+        if len(measured) < 2:
+            return
+
+        fastest = min(n.ewma_latency for n in measured)
+        threshold = max(fastest * self.outlier_factor, self.outlier_min_latency)
+        for node in measured:
+            if node is not self.primary and node.ewma_latency > threshold:
+                node.ejected_until = now + self.eject_seconds
+                # Re-admit at the pool's best latency rather than the stale outlier value
+                node.ewma_latency = fastest
+
+    def status(self) -> dict:
+        return {
+            "primary": self.primary.status(),
+            "replicas": [node.status() for node in self.replicas],
+        }
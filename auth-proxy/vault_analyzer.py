@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Storage analyzer for Obsidian LiveSync databases
+
+Streams every document once and reports how the vault is laid out:
+chunks per note, chunk and note size distributions, dedup ratio,
+attachment share, conflicts, revision depth and tombstones - then
+recommends minimumChunkSize, customChunkSize and longLineThreshold.
+
+Memory is constant: distinct chunks are counted with a HyperLogLog
+(16 KB, ~1% error) and distributions with DDSketch-style log-bucket
+quantile sketches (1% relative error), so multi-GB vaults cost only the
+time to stream them.
+
+Sources:
+    live database - a continuous _changes feed with include_docs and
+                    conflicts=true, which unlike _all_docs also yields
+                    tombstones; _conflicts lists only live conflicting leaves
+    --input FILE  - an export: NDJSON docs, or _all_docs / _changes output
+                    saved with one row per line (.gz accepted). The
+                    backup.sh tarballs hold raw .couch files and cannot be
+                    read directly; analyze a restored copy instead.
+
+Usage:
+    python3 vault_analyzer.py                     # DB_NAME
+    python3 vault_analyzer.py --db notes --json report.json
+    python3 vault_analyzer.py --input export.ndjson.gz
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import time
+from typing import Iterator, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from chunk_gc import CHUNK_PREFIX, chunk_hash
+from couchdb_stream import ChangesFeed, couchdb_client, db_path
+
+# Load environment variables from configurable path
+ENV_FILE = os.getenv("ENV_FILE", "/root/obsidian-livesync/.env")
+if os.path.exists(ENV_FILE):
+    load_dotenv(ENV_FILE)
+
+NOTE_TYPES = {"plain", "newnote", "notes"}
+# Chunk data that is base64 (binary files) rather than text
+BASE64_PREFIX = re.compile(r"^[A-Za-z0-9+/=]*$")
+TINY_CHUNK_BYTES = 64
+
+# setup_uri.py values the recommendations start from
+DEFAULT_CHUNKING = {"minimumChunkSize": 20, "customChunkSize": 0, "longLineThreshold": 250}
+
+
+class HyperLogLog:
+    """Distinct count of 64-bit hashes in 2^precision one-byte registers"""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self._shift = 64 - precision
+        self._mask = (1 << self._shift) - 1
+
+    def add(self, value: int):
+        index = value >> self._shift
+        rank = self._shift - (value & self._mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def __len__(self) -> int:
+        m = self.size
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate at low cardinality
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    """
+    DDSketch-style quantiles with bounded relative error
+
+    Values fall into logarithmic buckets of ratio gamma = (1+a)/(1-a), so
+    any quantile is within `relative_accuracy` of the true value and the
+    number of buckets grows with the log of the value range, not the count.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return float(self.max)
+
+    def share_below(self, limit: float) -> float:
+        """Approximate fraction of values below `limit`"""
+        if not self.count:
+            return 0.0
+        edge = math.log(limit) / self._log_gamma
+        below = self.zeros + sum(n for key, n in self.bins.items() if key <= edge)
+        return below / self.count
+
+    def summary(self) -> dict:
+        def rounded(value):
+            return None if value is None else round(value)
+
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 1) if self.count else None,
+            "p50": rounded(self.quantile(0.5)),
+            "p90": rounded(self.quantile(0.9)),
+            "p99": rounded(self.quantile(0.99)),
+            "max": self.max,
+        }
+
+
+class VaultAnalyzer:
+    def __init__(self):
+        self.counts = {"notes": 0, "chunks": 0, "other": 0, "design": 0, "deleted": 0, "deleted_chunks": 0}
+        self.note_bytes = QuantileSketch()
+        self.chunks_per_note = QuantileSketch()
+        self.chunk_bytes = QuantileSketch()
+        self.line_length = QuantileSketch()
+        self.rev_generation = QuantileSketch()
+        self.referenced = HyperLogLog()
+        self.references = 0
+        self.encrypted_chunks = 0
+        self.text_chunks = 0
+        self.attachment_docs = 0
+        self.attachment_bytes = 0
+        self.conflicted_docs = 0
+        self.extra_leaves = 0
+
+    def add(self, doc: dict, leaf_revs: int = 1, deleted: bool = False):
+        doc_id = doc.get("_id", "")
+        rev = doc.get("_rev")
+        if rev:
+            self.rev_generation.add(int(rev.split("-", 1)[0]))
+
+        if deleted or doc.get("_deleted"):
+            self.counts["deleted"] += 1
+            if doc_id.startswith(CHUNK_PREFIX):
+                self.counts["deleted_chunks"] += 1
+            return
+
+        leaf_revs = max(leaf_revs, 1 + len(doc.get("_conflicts") or ()))
+        if leaf_revs > 1:
+            self.conflicted_docs += 1
+            self.extra_leaves += leaf_revs - 1
+
+        attachments = doc.get("_attachments")
+        if attachments:
+            self.attachment_docs += 1
+            self.attachment_bytes += sum(a.get("length", 0) for a in attachments.values())
+
+        if doc_id.startswith(CHUNK_PREFIX) or doc.get("type") == "leaf":
+            self._add_chunk(doc.get("data") or "")
+        elif "children" in doc or doc.get("type") in NOTE_TYPES:
+            self.counts["notes"] += 1
+            children = doc.get("children") or ()
+            self.chunks_per_note.add(len(children))
+            self.references += len(children)
+            for chunk_id in children:
+                self.referenced.add(chunk_hash(chunk_id))
+            size = doc.get("size")
+            self.note_bytes.add(size if isinstance(size, int) else len((doc.get("data") or "").encode("utf-8")))
+        elif doc_id.startswith("_design/"):
+            self.counts["design"] += 1
+        else:
+            self.counts["other"] += 1
+
+    def _add_chunk(self, data: str):
+        self.counts["chunks"] += 1
+        # Stored size: chunk data is text or base64, so its UTF-8 length
+        self.chunk_bytes.add(len(data.encode("utf-8")))
+        if data.startswith("%"):
+            self.encrypted_chunks += 1
+        elif not BASE64_PREFIX.match(data[:128]):
+            self.text_chunks += 1
+            for line in data.split("\n"):
+                if line:
+                    self.line_length.add(len(line))
+
+    def report(self, db_info: Optional[dict] = None) -> dict:
+        # The estimate can land slightly above the exact reference count
+        distinct = min(len(self.referenced), self.references)
+        stored_chunk_bytes = self.chunk_bytes.sum
+        logical_bytes = self.note_bytes.sum
+        chunks = self.counts["chunks"]
+        report = {
+            "documents": dict(self.counts),
+            "notes": {
+                "size_bytes": self.note_bytes.summary(),
+                "chunks_per_note": self.chunks_per_note.summary(),
+            },
+            "chunks": {
+                "stored": chunks,
+                "stored_bytes": stored_chunk_bytes,
+                "size_bytes": self.chunk_bytes.summary(),
+                "tiny_share": round(self.chunk_bytes.share_below(TINY_CHUNK_BYTES), 4),
+                "encrypted_share": round(self.encrypted_chunks / chunks, 4) if chunks else 0.0,
+                "text_share": round(self.text_chunks / chunks, 4) if chunks else 0.0,
+            },
+            "dedup": {
+                "references": self.references,
+                "distinct_referenced": distinct,
+                "reference_ratio": round(self.references / distinct, 3) if distinct else None,
+                "note_bytes": logical_bytes,
+                "byte_ratio": round(logical_bytes / stored_chunk_bytes, 3) if stored_chunk_bytes else None,
+                "unreferenced_estimate": max(0, chunks - distinct),
+            },
+            "attachments": {
+                "docs": self.attachment_docs,
+                "bytes": self.attachment_bytes,
+                "share": (
+                    round(self.attachment_bytes / (self.attachment_bytes + stored_chunk_bytes), 4)
+                    if self.attachment_bytes else 0.0
+                ),
+            },
+            "revisions": {
+                "generation": self.rev_generation.summary(),
+                "conflicted_docs": self.conflicted_docs,
+                "extra_leaf_revisions": self.extra_leaves,
+            },
+            "text_lines": {
+                **self.line_length.summary(),
+                "over_default_threshold": round(
+                    1 - self.line_length.share_below(DEFAULT_CHUNKING["longLineThreshold"]), 4),
+            },
+        }
+        if db_info:
+            sizes = db_info.get("sizes", {})
+            report["storage"] = {
+                "file_bytes": sizes.get("file"),
+                "active_bytes": sizes.get("active"),
+                "external_bytes": sizes.get("external"),
+                "fragmentation": round(sizes["file"] / sizes["active"], 2) if sizes.get("active") else None,
+                "revs_limit": db_info.get("revs_limit"),
+            }
+        report["recommended"], report["advice"] = recommend(report)
+        return report
+
+
+def recommend(report: dict) -> Tuple[dict, list]:
+    """
+    (settings, advice) for chunking and housekeeping from an analysis report
+
+    minimumChunkSize  - raised when many chunks are tiny: each one is a
+                        document with its own revision tree and round trip
+    customChunkSize   - raised for vaults of large notes split into many
+                        chunks that barely deduplicate
+    longLineThreshold - raised when long lines are common in text chunks
+                        (unknown for encrypted vaults)
+    """
+    settings = dict(DEFAULT_CHUNKING)
+    notes = []
+    chunks = report["chunks"]
+    per_note = report["notes"]["chunks_per_note"]
+    ratio = report["dedup"]["reference_ratio"] or 1.0
+
+    if chunks["tiny_share"] > 0.5:
+        settings["minimumChunkSize"] = 100
+    elif chunks["tiny_share"] > 0.25:
+        settings["minimumChunkSize"] = 50
+
+    if per_note["count"] and ratio < 1.2:
+        if per_note["p90"] >= 400:
+            settings["customChunkSize"] = 2
+        elif per_note["p90"] >= 100:
+            settings["customChunkSize"] = 1
+    elif ratio >= 1.2:
+        notes.append(f"chunks are shared {ratio:.2f}x on average; larger chunks would deduplicate less")
+
+    lines = report["text_lines"]
+    if lines["count"] >= 1000 and lines["over_default_threshold"] > 0.1:
+        settings["longLineThreshold"] = min(1000, max(250, int(math.ceil(lines["p90"] / 100.0)) * 100))
+    elif chunks["encrypted_share"] > 0.5:
+        notes.append("chunks are end-to-end encrypted; longLineThreshold left at its default")
+
+    unreferenced = report["dedup"]["unreferenced_estimate"]
+    if chunks["stored"] and unreferenced > 0.1 * chunks["stored"]:
+        notes.append(f"~{unreferenced:,} chunks look unreferenced; see chunk_gc.py")
+    if report["revisions"]["conflicted_docs"]:
+        notes.append(f"{report['revisions']['conflicted_docs']:,} documents have unresolved conflicts")
+    storage = report.get("storage") or {}
+    if storage.get("fragmentation") and storage["fragmentation"] > 2:
+        notes.append(f"database file is {storage['fragmentation']}x its live data; compaction would reclaim it")
+    if settings != DEFAULT_CHUNKING:
+        notes.append("chunking settings are vault-wide: apply them on every device, then rebuild "
+                     "so existing notes are re-chunked")
+    return settings, notes
+
+
+def read_export(path: str) -> Iterator[Tuple[dict, int, bool]]:
+    """(doc, leaf revisions, deleted) from an NDJSON or one-row-per-line JSON export"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if not line.startswith("{") or line.startswith('{"total_rows"') or line.startswith('{"results"'):
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if "last_seq" in row and "id" not in row:
+                continue
+            doc = row.get("doc", row)
+            if not isinstance(doc, dict):
+                continue
+            # style=all_docs leaves include deleted ones (resolved conflicts);
+            # with a document body, its _conflicts holds only the live ones
+            leaf_revs = 1 if "doc" in row else len(row.get("changes") or ()) or 1
+            yield doc, leaf_revs, bool(row.get("deleted"))
+
+
+def read_database(client: httpx.Client, database: str, limit: Optional[int]) -> Iterator[Tuple[dict, int, bool]]:
+    # conflicts=true rather than style=all_docs: all_docs leaves include the
+    # deleted losers of conflicts that were already resolved
+    feed = ChangesFeed(client, database, include_docs=True, conflicts=True, limit=limit)
+    for change in feed:
+        yield change.get("doc") or {"_id": change["id"]}, 1, bool(change.get("deleted"))
+
+
+def print_report(report: dict, source: str, elapsed: float, documents: int):
+    def mb(value):
+        return f"{(value or 0) / 1024 / 1024:,.1f} MB"
+
+    counts = report["documents"]
+    chunks = report["chunks"]
+    dedup = report["dedup"]
+    print(f"\n📊 Vault analysis of {source}: {documents:,} docs in {elapsed:.1f}s "
+          f"({documents / max(elapsed, 1e-9):,.0f} docs/s)")
+    print(f"   Notes: {counts['notes']:,}   Chunks: {counts['chunks']:,}   Other: {counts['other']:,}   "
+          f"Deleted: {counts['deleted']:,} ({counts['deleted_chunks']:,} chunks)")
+
+    print("\n   Distribution        count       mean        p50        p90        p99        max")
+    rows = [
+        ("note size (B)", report["notes"]["size_bytes"]),
+        ("chunks per note", report["notes"]["chunks_per_note"]),
+        ("chunk size (B)", chunks["size_bytes"]),
+        ("text line length", report["text_lines"]),
+        ("rev generation", report["revisions"]["generation"]),
+    ]
+    for label, s in rows:
+        cells = [s["count"], s["mean"], s["p50"], s["p90"], s["p99"], s["max"]]
+        print(f"   {label:<17}" + "".join(f"{'-' if c is None else f'{c:,.0f}':>11}" for c in cells))
+
+    print(f"\n   Chunk bytes stored:   {mb(chunks['stored_bytes'])}  (tiny <{TINY_CHUNK_BYTES} B: "
+          f"{chunks['tiny_share']:.1%}, encrypted: {chunks['encrypted_share']:.1%})")
+    print(f"   Note bytes:           {mb(dedup['note_bytes'])}  (dedup {dedup['byte_ratio'] or '-'}x by bytes)")
+    print(f"   Chunk references:     {dedup['references']:,} to ~{dedup['distinct_referenced']:,} distinct "
+          f"({dedup['reference_ratio'] or '-'}x), ~{dedup['unreferenced_estimate']:,} unreferenced")
+    print(f"   Attachments:          {report['attachments']['docs']:,} docs, {mb(report['attachments']['bytes'])} "
+          f"({report['attachments']['share']:.1%} of stored bytes)")
+    print(f"   Conflicts:            {report['revisions']['conflicted_docs']:,} docs, "
+          f"{report['revisions']['extra_leaf_revisions']:,} extra leaf revisions")
+    storage = report.get("storage")
+    if storage:
+        print(f"   Database file:        {mb(storage['file_bytes'])} for {mb(storage['active_bytes'])} live "
+              f"({storage['fragmentation'] or '-'}x), revs_limit {storage['revs_limit']}")
+
+    print("\n⚙️  Recommended settings:")
+    for name, value in report["recommended"].items():
+        marker = "" if value == DEFAULT_CHUNKING[name] else f"   (default {DEFAULT_CHUNKING[name]})"
+        print(f"   {name}: {value}{marker}")
+    for note in report["advice"]:
+        print(f"   ℹ️  {note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze LiveSync vault storage and recommend chunk settings")
+    parser.add_argument("--db", default=os.getenv("DB_NAME", "obsidian-sync"), help="database (default: DB_NAME)")
+    parser.add_argument("--couchdb-url", default=None, help="CouchDB URL (default: COUCHDB_URL / COUCHDB_HOST:PORT)")
+    parser.add_argument("--input", default=None, help="analyze an NDJSON/_all_docs export instead (.gz ok)")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many documents (sampling)")
+    parser.add_argument("--json", default=None, help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    analyzer = VaultAnalyzer()
+    db_info = None
+    if args.input:
+        source = args.input
+        rows = read_export(args.input)
+    else:
+        source = args.db
+        client = couchdb_client(args.couchdb_url)
+        try:
+            info = client.get(db_path(args.db))
+            info.raise_for_status()
+            db_info = info.json()
+            revs_limit = client.get(f"{db_path(args.db)}/_revs_limit")
+            if revs_limit.is_success:
+                db_info["revs_limit"] = revs_limit.json()
+        except httpx.HTTPError as e:
+            print(f"❌ Cannot open database {args.db}: {e}")
+            sys.exit(1)
+        print(f"🔎 Analyzing {args.db} ({db_info.get('doc_count', 0):,} docs, "
+              f"{db_info.get('doc_del_count', 0):,} deleted)")
+        rows = read_database(client, args.db, args.limit)
+
+    started = time.monotonic()
+    seen = 0
+    for doc, leaf_revs, deleted in rows:
+        analyzer.add(doc, leaf_revs, deleted)
+        seen += 1
+        if seen == args.limit:
+            break
+        if seen % 250000 == 0:
+            print(f"   {seen:,} docs ({seen / (time.monotonic() - started):,.0f}/s)")
+    elapsed = time.monotonic() - started
+
+    report = analyzer.report(db_info)
+    report["source"] = source
+    print_report(report, source, elapsed, seen)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n   Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
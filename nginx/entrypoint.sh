@@ -3,8 +3,25 @@ set -e
 
 echo "🔧 Configuring nginx..."
 
+# Pick the config template for the auth mode
+# - proxy (default): all traffic flows through the auth proxy
+# - offload: nginx uses auth_request and proxies bodies directly to CouchDB
+TEMPLATE=/etc/nginx/nginx.conf.template
+if [ "$AUTH_MODE" = "offload" ]; then
+    echo "🔐 Auth mode: offload (auth_request, bodies go directly to CouchDB)"
+    if [ -z "$AUTH_VERIFY_SECRET" ]; then
+        echo "❌ AUTH_MODE=offload requires AUTH_VERIFY_SECRET"
+        exit 1
+    fi
+    TEMPLATE=/etc/nginx/nginx.offload.conf.template
+    mkdir -p /var/cache/nginx/auth
+    # nginx injects CouchDB credentials itself; the auth proxy only decides
+    COUCHDB_BASIC_AUTH="Basic $(printf '%s:%s' "$COUCHDB_USER" "$COUCHDB_PASSWORD" | base64 | tr -d '\n')"
+    export COUCHDB_BASIC_AUTH
+fi
+
 # Replace environment variables in nginx config template
-envsubst '${DOMAIN} ${AUTH_PROXY_PORT}' < /etc/nginx/nginx.conf.template > /etc/nginx/conf.d/default.conf
+envsubst '${DOMAIN} ${AUTH_PROXY_PORT} ${COUCHDB_HOST} ${COUCHDB_PORT} ${COUCHDB_BASIC_AUTH} ${AUTH_VERIFY_SECRET}' < "$TEMPLATE" > /etc/nginx/conf.d/default.conf
 
 # Check SSL method
 if [ "$SSL_METHOD" = "letsencrypt" ]; then
@@ -25,12 +42,17 @@ server {
         root /var/www/certbot;
     }
 
+    location /admin/ {
+        return 404;
+    }
+
     location / {
         proxy_pass http://auth-proxy:${AUTH_PROXY_PORT};
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
         proxy_set_header X-Forwarded-Proto \$scheme;
+        proxy_set_header X-Auth-Verify-Secret "";
     }
 }
 EOF
@@ -51,12 +73,17 @@ server {
     listen 80;
     server_name ${DOMAIN};
 
+    location /admin/ {
+        return 404;
+    }
+
     location / {
         proxy_pass http://auth-proxy:${AUTH_PROXY_PORT};
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
         proxy_set_header X-Forwarded-Proto \$scheme;
+        proxy_set_header X-Auth-Verify-Secret "";
     }
 }
 EOF